@@ -3,6 +3,8 @@
 # You like pasghetti code? No problem, you get pasghetti code.
 import sys
 import struct
+import re
+import array
 from PIL import Image
 import png
 import random
@@ -12,6 +14,15 @@ import argparseui
 import os
 import math
 import gc
+import numpy as np
+import hashlib
+import multiprocessing
+import multiprocessing.sharedctypes
+import multiprocessing.pool
+import subprocess
+import signal
+import mmap
+import threading
 
 print 'Welcome to the SMF compiler/decompiler by Beherith (mysterme@gmail.com)'
 
@@ -49,6 +60,7 @@ MapFeatureHeader_struct = struct.Struct('< i i')
 	int numFeatures;'''
 
 MapFeatureStruct_struct = struct.Struct('< i f f f f f')
+MapFeatureStruct_dtype = np.dtype([('type', '<i4'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('rot', '<f4'), ('scale', '<f4')])
 '''int featureType;    ///< Index to one of the strings above
 	float xpos;         ///< X coordinate of the feature
 	float ypos;         ///< Y coordinate of the feature (height)
@@ -68,110 +80,393 @@ SMALL_TILE_SIZE = 680
 MINIMAP_SIZE = 699048
 
 
-def pythonDecodeDXT1(data):  # Python-only DXT1 decoder; this is slow!
-	# input: one "row" of data (i.e. will produce 4*width pixels)
-	blocks = len(data) / 8  # number of blocks in row
-	out = ['', '', '', '']  # row accumulators
-
-	for xb in xrange(blocks):
-		# Decode next 8-byte block.
-		c0, c1, bits = struct.unpack('<HHI', data[xb * 8:xb * 8 + 8])
-		# print c0,c1,bits
-		# color 0, packed 5-6-5
-		b0 = (c0 & 0x1f) << 3
-		g0 = ((c0 >> 5) & 0x3f) << 2
-		r0 = ((c0 >> 11) & 0x1f) << 3
-
-		# color 1, packed 5-6-5
-		b1 = (c1 & 0x1f) << 3
-		g1 = ((c1 >> 5) & 0x3f) << 2
-		r1 = ((c1 >> 11) & 0x1f) << 3
-
-		# Decode this block into 4x4 pixels
-		# Accumulate the results onto our 4 row accumulators
-		for yo in xrange(4):
-			for xo in xrange(4):
-				# get next control op and generate a pixel
-
-				control = bits & 3
-				bits = bits >> 2
-				if control == 0:
-					out[yo] += chr(r0) + chr(g0) + chr(b0)
-				elif control == 1:
-					out[yo] += chr(r1) + chr(g1) + chr(b1)
-				elif control == 2:
-					if c0 > c1:
-						out[yo] += chr((2 * r0 + r1 + 1) / 3) + chr((2 * g0 + g1 + 1) / 3) + chr((2 * b0 + b1 + 1) / 3)
-					else:
-						out[yo] += chr((r0 + r1) / 2) + chr((g0 + g1) / 2) + chr((b0 + b1) / 2)
-				elif control == 3:
-					if c0 > c1:
-						out[yo] += chr((2 * r1 + r0 + 1) / 3) + chr((2 * g1 + g0 + 1) / 3) + chr((2 * b1 + b0 + 1) / 3)
-					else:
-						out[yo] += '\0\0\0'
-
-	# All done.
-	return out
-
-
-def pythonEncodeDXT1(
-		data):  # color bounding box algorithm, this is absolutely trashy and slow and only exists because im too lazy to include a linux compressor
-	# also, i havent even tested this yet, dont even think about using it
-	# we are expecting 16 RGB or RGBA pixels
-	def rgbto565(pix):
-		return struct.pack('<H', (int(pix[0]) / 8) * (2 ** 11) + (int(pix[1]) / 4) * (2 ** 5) + (int(pix[2]) / 8))
-
-	def diff(a, b):
-		d = 0
-		for i in range(len(a)):
-			d += abs(a[i] - b[i])
-		return d
-
-	havealpha = False
-	if len(data[0]) > 3:
-		havealpha = True
-	weights = (1.0, 1.0, 1.0)
-	weighted = []
-	mins = [10.0, 10.0, 10.0]
-	maxes = [0.0, 0.0, 0.0]
-	for pixel in data:
-		newpix = [0, 0, 0]
-		for c in range(3):
-			newpix[c] = pixel[c] * weights[c]
-			mins[c] = min(newpix[c], mins[c])
-			maxes[c] = max(newpix[c], mins[c])
-		weighted.append(newpix)
-	# rescale BB by 10% (trash)
-	# for c in range(3):
-	#	mins[c]=mins[c]*1.1
-	#	maxes[c]=maxes[c]*1.1
-	outchunk = b'' + rgbto565(maxes) + rgbto565(mins)
-	c2 = [0, 0, 0]
-	c3 = [0, 0, 0]
-	for i in range(3):
-		c2[i] = 0.666 * maxes[i] + 0.333 * mins[i]
-		c3[i] = 0.333 * maxes[i] + 0.666 * mins[i]
-	lookup = []
-	best = -1
-	bestdiff = 100000
-	for pixel in weighted:
-		if diff(pixel, maxes) < bestdiff:
-			bestdiff = diff(pixel, maxes)
-			best = 0
-		if diff(pixel, mins) < bestdiff:
-			bestdiff = diff(pixel, mins)
-			best = 1
-		if diff(pixel, c2) < bestdiff:
-			bestdiff = diff(pixel, c2)
-			best = 2
-		if diff(pixel, c3) < bestdiff:
-			bestdiff = diff(pixel, c3)
-			best = 3
-		lookup.append(best)
-	lookup32 = 0L
-	for i in range(len(data)):
-		lookup32 += lookup[i] * (2 ** (2 * i))
-	return outchunk + struct.pack('<I', lookup32)  # archer-esque 'woooooo'
+def numpyDecodeDXT1(data):  # vectorized DXT1 decoder, returns an (n, 4, 4, 3) uint8 array of pixels for n 8-byte blocks
+	blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 8)
+	numblocks = blocks.shape[0]
+	colors = blocks[:, 0:4].copy().view('<u2').astype(np.int32)  # c0, c1 packed 5-6-5
+	bits = blocks[:, 4:8].copy().view('<u4').astype(np.int64)
+
+	# expand 5-6-5 to 8 bits by bit replication, like the GPU does
+	endpoints = np.empty((numblocks, 2, 3), dtype=np.int32)
+	endpoints[:, :, 0] = ((colors >> 11) & 0x1f) << 3 | ((colors >> 13) & 0x07)
+	endpoints[:, :, 1] = ((colors >> 5) & 0x3f) << 2 | ((colors >> 9) & 0x03)
+	endpoints[:, :, 2] = (colors & 0x1f) << 3 | ((colors >> 2) & 0x07)
+	color0 = endpoints[:, 0]
+	color1 = endpoints[:, 1]
+
+	# c0 > c1 is the 4 color mode, otherwise the 3 color mode with index 3 being transparent (black)
+	fourcolor = (colors[:, 0] > colors[:, 1])[:, np.newaxis]
+	palette = np.empty((numblocks, 4, 3), dtype=np.uint8)
+	palette[:, 0] = color0
+	palette[:, 1] = color1
+	palette[:, 2] = np.where(fourcolor, (2 * color0 + color1 + 1) // 3, (color0 + color1) // 2)
+	palette[:, 3] = np.where(fourcolor, (color0 + 2 * color1 + 1) // 3, 0)
+
+	# 2 bit control codes, first pixel in the lowest bits, 4 rows of 4 pixels
+	control = (bits >> np.arange(0, 32, 2)) & 3
+	pixels = palette[np.arange(numblocks)[:, np.newaxis], control]
+	return pixels.reshape(numblocks, 4, 4, 3)
+
+
+def numpyDecodeTiles(tiles, level=0, batchsize=4096):
+	# decodes one level of n SMT tiles (0 is the 32x32 main level, 1-3 the 16x16, 8x8 and 4x4 mips)
+	# returns an (n, size, size, 3) array
+	tiles = np.frombuffer(tiles, dtype=np.uint8).reshape(-1, SMALL_TILE_SIZE)
+	offset = [0, 512, 640, 672][level]
+	blocksperside = 8 >> level
+	size = 32 >> level
+	decoded = np.empty((tiles.shape[0], size, size, 3), dtype=np.uint8)
+	for start in range(0, tiles.shape[0], batchsize):  # in batches, to keep the temporary arrays of the decoder small
+		pixels = numpyDecodeDXT1(np.ascontiguousarray(tiles[start:start + batchsize, offset:offset + blocksperside ** 2 * 8]))
+		decoded[start:start + batchsize] = pixels.reshape(-1, blocksperside, blocksperside, 4, 4, 3).swapaxes(2, 3).reshape(
+			-1, size, size, 3)
+	return decoded
+
+
+def tileHashes(tiles, levels=7, tables=4, hashes=4, batchsize=16384):
+	# locality sensitive hashes of the 8x8 mips of n SMT tiles, for finding similar tiles without comparing all pairs.
+	# a table hashes each tile to the cells that its projections on a few random directions fall in, measured in RMS
+	# error units, so tiles whose error is small compared to the cell width mostly share a bucket in it.
+	# The cell widths are fixed, 4, 8, 16 ... for the levels, and do not depend on the merging threshold.
+	# Returns the bucket number of each tile for every table, from the finest to the coarsest.
+	numtiles = tiles.shape[0]
+	randomstate = np.random.RandomState(numtiles)  # reproducible for the same tile file
+	mips = numpyDecodeTiles(tiles, 2).reshape(numtiles, -1)
+	directions = randomstate.standard_normal((mips.shape[1], levels * tables * hashes)).astype(np.float32) / np.sqrt(
+		mips.shape[1])
+	widths = np.repeat(4.0 * 2 ** np.arange(levels), tables * hashes).astype(np.float32)
+	offsets = randomstate.uniform(0.0, 1.0, levels * tables * hashes).astype(np.float32)
+	cells = np.empty((numtiles, levels * tables * hashes), dtype=np.int32)
+	for start in range(0, numtiles, batchsize):
+		cells[start:start + batchsize] = np.floor(mips[start:start + batchsize].astype(np.float32).dot(directions) / widths + offsets)
+	buckets = []
+	for table in range(levels * tables):
+		keys = np.ascontiguousarray(cells[:, table * hashes:(table + 1) * hashes])
+		buckets.append(np.unique(keys.view(np.dtype((np.void, keys.shape[1] * keys.itemsize))).ravel(),
+								 return_inverse=True)[1].ravel())
+	return buckets
+
+
+def tileErrors(details, tiles, others, batchsize=2 ** 20):  # the RMS error between the details of pairs of tiles
+	errors = np.empty(tiles.shape[0], dtype=np.float32)
+	batchrows = max(1, batchsize / details.shape[1])  # batches of about batchsize values
+	for start in range(0, tiles.shape[0], batchrows):
+		difference = details[tiles[start:start + batchrows]].astype(np.float32) - details[others[start:start + batchrows]]
+		errors[start:start + batchrows] = np.sqrt(np.einsum('ij,ij->i', difference, difference) / details.shape[1])
+	return errors
+
+
+def firstFits(representatives, spread, levels, tiles, targets, distances, threshold, attempts=4):
+	# finds the first of the targets of each representative tile that its whole group fits, trying them in the given
+	# order. The distances are those between the tiles and the targets, the spread is the error of each tile to its own
+	# representative: by the triangle inequality a member fits if its spread plus the distance is within threshold, so
+	# only the others are compared, the farthest member of each group first. The members are compared on each of the
+	# levels in turn, mips whose error is a lower bound of that of the last, the details. Returns the tiles and their
+	# target or -1
+	details = levels[-1]
+	# the tiles of the groups that may move, group by group, the farthest from the representative first
+	moving = np.zeros(details.shape[0], dtype=bool)
+	moving[tiles] = True
+	grouped = np.flatnonzero(moving[representatives])
+	grouped = grouped[np.lexsort((-spread[grouped], representatives[grouped]))]
+	groupsizes = np.bincount(representatives[grouped], minlength=details.shape[0])
+	groupstarts = np.cumsum(groupsizes) - groupsizes
+	order = np.argsort(tiles, kind='mergesort')
+	tiles, targets, distances = tiles[order], targets[order], distances[order]
+	starts = np.flatnonzero(np.diff(np.concatenate(([-1], tiles))))
+	counts = np.minimum(np.diff(np.append(starts, tiles.shape[0])), attempts)
+	found = np.empty(starts.shape[0], dtype=np.int64)
+	found.fill(-1)
+	untried = np.arange(starts.shape[0])
+	attempt = 0
+	while untried.shape[0] > 0:
+		pairs = starts[untried] + attempt
+		farthest = grouped[groupstarts[tiles[pairs]]]
+		fits = np.ones(pairs.shape[0], dtype=bool)
+		for mips in levels:
+			fits[fits] = tileErrors(mips, farthest[fits], targets[pairs[fits]]) <= threshold
+		check = np.flatnonzero(fits & (spread[farthest] + distances[pairs] > threshold))
+		sizes = groupsizes[tiles[pairs[check]]]
+		checked = np.repeat(check, sizes)
+		members = grouped[np.repeat(groupstarts[tiles[pairs[check]]] - (np.cumsum(sizes) - sizes), sizes) + np.arange(
+			checked.shape[0])]
+		unsure = spread[members] + distances[pairs[checked]] > threshold
+		checked, members = checked[unsure], members[unsure]
+		for mips in levels:
+			fitting = fits[checked]
+			checked, members = checked[fitting], members[fitting]
+			fits[checked[tileErrors(mips, members, targets[pairs[checked]]) > threshold]] = False
+		found[untried[fits]] = targets[pairs[fits]]
+		attempt += 1
+		untried = untried[~fits & (counts[untried] > attempt)]
+	return tiles[starts], found
+
+
+def mergeSimilarTiles(buckets, details, usage, threshold, start=None, leaders=32):
+	# lossy tile merging: groups of tiles are merged into the representative of a similar, more used group if every tile
+	# of them is within an RMS error of threshold of it. Candidates come from the locality sensitive hash tables of
+	# tileHashes, from the finest to the coarsest: in each, every representative is compared with the most used ones of
+	# its bucket, up to leaders of them, then a last pass compares all of them with the most used ones overall. Merging
+	# changes who leads the buckets, so the tables are gone through again until nothing merges any more. The error is
+	# measured on the decoded 16x16 mips. A merge with a lower threshold stays valid for a higher one, so it can be
+	# carried on from by passing its representatives as start. Returns the representative tile of each tile.
+	numtiles = details.shape[0]
+	representatives = np.arange(numtiles) if start is None else start.copy()
+	spread = tileErrors(details, np.arange(numtiles), representatives)  # the error of each tile to its representative
+	# the RMS error of the mean colors and of the 4x4 mips is never larger than that of the 16x16 ones, so they cheaply
+	# rule out most pairs
+	levels = (details.reshape(numtiles, -1, 3).mean(axis=1, dtype=np.float32),
+			  details.reshape(numtiles, 4, 4, 4, 4, 3).mean(axis=(2, 4), dtype=np.float32).reshape(numtiles, -1), details)
+	tables = buckets + [np.zeros(numtiles, dtype=np.int64)]
+	# a pair of representatives whose groups are the same as the last time they were gone through in a table is not
+	# gone through again, changed holds the step in which the group of each tile last changed
+	changed = np.zeros(numtiles, dtype=np.int64)
+	visited = np.zeros(len(tables), dtype=np.int64)
+	step = 0
+	merged = True
+	while merged:
+		merged = False
+		for table, tablebuckets in enumerate(tables):
+			step += 1
+			since, visited[table] = visited[table], step
+			dirty = np.zeros(tablebuckets.max() + 1, dtype=bool)
+			dirty[tablebuckets[changed >= since]] = True
+			kept = np.flatnonzero((representatives == np.arange(numtiles)) & dirty[tablebuckets])
+			groupusage = np.bincount(representatives, weights=usage, minlength=numtiles)
+			# the most used representatives of each bucket lead it, ties go to the first seen tile
+			order = kept[np.lexsort((kept, -groupusage[kept], tablebuckets[kept]))]
+			sortedbuckets = tablebuckets[order]
+			firsts = np.flatnonzero(np.concatenate(([True], sortedbuckets[1:] != sortedbuckets[:-1])))
+			bucketstarts = np.repeat(firsts, np.diff(np.append(firsts, order.shape[0])))
+			# pair each representative with the ones ranked above it, the most used first
+			counts = np.minimum(np.arange(order.shape[0]) - bucketstarts, leaders)
+			tiles = np.repeat(order, counts)
+			candidates = order[np.repeat(bucketstarts - (np.cumsum(counts) - counts), counts) + np.arange(tiles.shape[0])]
+			fresh = (changed[tiles] >= since) | (changed[candidates] >= since)
+			tiles, candidates = tiles[fresh], candidates[fresh]
+			for mips in levels[:-1]:
+				close = tileErrors(mips, tiles, candidates) <= threshold
+				tiles, candidates = tiles[close], candidates[close]
+			distances = tileErrors(details, tiles, candidates)
+			close = distances <= threshold
+			if not close.any():
+				continue
+			# the whole group has to fit, as its other tiles were only compared with their own representative so far.
+			# Each representative moves to the first, most used, candidate that it fits, and when it fits none, the more
+			# used groups it is close to may still fit it instead
+			tiles, candidates, distances = tiles[close], candidates[close], distances[close]
+			movers, found = firstFits(representatives, spread, levels, tiles, candidates, distances, threshold)
+			targets = np.arange(numtiles)
+			targets[movers[found >= 0]] = found[found >= 0]
+			stuck = targets[tiles] == tiles
+			movers, found = firstFits(representatives, spread, levels, candidates[stuck], tiles[stuck], distances[stuck],
+									  threshold)
+			reverse = (found >= 0) & (targets[movers] == movers)
+			targets[movers[reverse]] = found[reverse]
+			# a target that moves itself this time around is merged into on the next pass instead
+			cancelled = np.flatnonzero(targets[targets] != targets)
+			targets[cancelled] = cancelled
+			changed[cancelled] = step
+			moving = np.flatnonzero(targets[representatives] != representatives)
+			if moving.shape[0] > 0:
+				representatives[moving] = targets[representatives[moving]]
+				spread[moving] = tileErrors(details, moving, representatives[moving])
+				changed[moving] = step
+				changed[representatives[moving]] = step
+				merged = True
+	return representatives
+
+
+def compressTileFile(smtfilename, tileindices, threshold, maxtiles):
+	# merges similar tiles of a finished .smt in place, and rewrites tileindices to the kept representatives
+	numtiles = TileFileHeader_struct.unpack(open(smtfilename, 'rb').read(TileFileHeader_struct.size))[2]
+	tiles = np.memmap(smtfilename, dtype=np.uint8, mode='r+', offset=TileFileHeader_struct.size,
+					  shape=(numtiles, SMALL_TILE_SIZE))
+	usage = np.bincount(tileindices, minlength=numtiles)
+	buckets = tileHashes(tiles)
+	details = numpyDecodeTiles(tiles, 1).reshape(numtiles, -1)
+	representatives = mergeSimilarTiles(buckets, details, usage, threshold)
+	kept = np.count_nonzero(representatives == np.arange(numtiles))
+	if maxtiles > 0 and kept > maxtiles:
+		# binary search for the smallest error threshold that fits the tile budget, each merge carries on from the one
+		# with the highest threshold below it
+		low, high = threshold, 255.0
+		lowrepresentatives, highrepresentatives = representatives, None
+		for i in range(12):
+			middle = (low + high) / 2
+			candidates = mergeSimilarTiles(buckets, details, usage, middle, lowrepresentatives)
+			if np.count_nonzero(candidates == np.arange(numtiles)) <= maxtiles:
+				high, highrepresentatives = middle, candidates
+			else:
+				low, lowrepresentatives = middle, candidates
+		threshold = high
+		if highrepresentatives is None:
+			highrepresentatives = mergeSimilarTiles(buckets, details, usage, threshold, lowrepresentatives)
+		representatives = highrepresentatives
+		kept = np.count_nonzero(representatives == np.arange(numtiles))
+	print 'Lossy compression with an RMS error threshold of %f merged %i similar tiles, %i of %i tiles remain' % (
+		threshold, numtiles - kept, kept, numtiles)
+
+	# kept tiles stay in first seen order, so they can be moved down in place, batch by batch
+	survivors = np.flatnonzero(representatives == np.arange(numtiles))
+	newnumbers = np.empty(numtiles, dtype=np.int32)
+	newnumbers[survivors] = np.arange(kept)
+	for start in range(0, kept, 4096):
+		end = min(start + 4096, kept)
+		tiles[start:end] = tiles[survivors[start:end]]
+	tiles.flush()
+	del tiles
+	tileindices[:] = newnumbers[representatives[tileindices]]
+	tilefile = open(smtfilename, 'r+b')
+	tilefile.write(TileFileHeader_struct.pack('spring tilefile\0', 1, kept, 32, 1))
+	tilefile.truncate(TileFileHeader_struct.size + kept * SMALL_TILE_SIZE)
+	tilefile.close()
+	return kept
+
+
+def pack565(colors):  # quantizes float RGB colors to packed 5-6-5 ints
+	colors = np.clip(colors, 0.0, 255.0)
+	r = np.rint(colors[..., 0] * (31.0 / 255.0)).astype(np.int32)
+	g = np.rint(colors[..., 1] * (63.0 / 255.0)).astype(np.int32)
+	b = np.rint(colors[..., 2] * (31.0 / 255.0)).astype(np.int32)
+	return (r << 11) | (g << 5) | b
+
+
+def unpack565(packed):  # packed 5-6-5 ints to RGB, with the same bit replication as numpyDecodeDXT1
+	colors = np.empty(packed.shape + (3,), dtype=np.int32)
+	colors[..., 0] = ((packed >> 11) & 0x1f) << 3 | ((packed >> 13) & 0x07)
+	colors[..., 1] = ((packed >> 5) & 0x3f) << 2 | ((packed >> 9) & 0x03)
+	colors[..., 2] = (packed & 0x1f) << 3 | ((packed >> 2) & 0x07)
+	return colors
+
+
+def singleColorTable(bits):  # for each 8 bit value, the pair of endpoints whose 2/3 interpolation reproduces it best
+	expanded = np.arange(1 << bits)
+	expanded = (expanded << (8 - bits)) | (expanded >> (2 * bits - 8))
+	interpolated = (2 * expanded[:, np.newaxis] + expanded[np.newaxis, :] + 1) // 3
+	best = np.abs(interpolated[np.newaxis, :, :] - np.arange(256)[:, np.newaxis, np.newaxis]).reshape(256, -1).argmin(axis=1)
+	return np.array([best // (1 << bits), best % (1 << bits)], dtype=np.int32).T
+
+
+DXT1_SINGLE5 = singleColorTable(5)
+DXT1_SINGLE6 = singleColorTable(6)
+
+
+def fitDXT1Indices(pixels, opaque, color0, color1, threecolor):
+	# builds the palette of each block exactly like the decoder does, and picks the closest entry for each opaque pixel
+	# returns the ordered endpoints, the indices and the squared error of each block
+	lo = np.minimum(color0, color1)
+	hi = np.maximum(color0, color1)
+	first = np.where(threecolor, lo, hi)  # c0 > c1 selects 4 color mode, c0 <= c1 the 3 color + transparent mode
+	second = np.where(threecolor, hi, lo)
+	p0 = unpack565(first)
+	p1 = unpack565(second)
+	palette = np.empty((pixels.shape[0], 4, 3), dtype=np.float32)
+	palette[:, 0] = p0
+	palette[:, 1] = p1
+	three = threecolor[:, np.newaxis]
+	palette[:, 2] = np.where(three, (p0 + p1) // 2, (2 * p0 + p1 + 1) // 3)
+	palette[:, 3] = np.where(three, 0, (p0 + 2 * p1 + 1) // 3)
+
+	distances = ((pixels[:, :, np.newaxis, :] - palette[:, np.newaxis, :, :]) ** 2).sum(axis=3)
+	distances[:, :, 3] = np.where(three, np.inf, distances[:, :, 3])  # index 3 is transparent in 3 color mode
+	indices = distances.argmin(axis=2)
+	errors = (distances.min(axis=2) * opaque).sum(axis=1)
+	return first, second, indices, errors
+
+
+def numpyEncodeDXT1(blocks, refinements=2, batchsize=16384):
+	# vectorized DXT1 (BC1) encoder, takes an (n, 16, 3 or 4) uint8 array of 4x4 blocks, returns an (n, 8) uint8 array
+	# endpoints are fitted along the principal axis of each block, then refined by least squares on the chosen indices
+	# blocks with any alpha < 128 pixel are encoded in the 3 color mode, with those pixels transparent (dxt1a)
+	numblocks = blocks.shape[0]
+	encoded = np.empty(numblocks, dtype=[('c0', '<u2'), ('c1', '<u2'), ('bits', '<u4')])
+	for start in range(0, numblocks, batchsize):
+		batch = blocks[start:start + batchsize]
+		pixels = batch[:, :, 0:3].astype(np.float32)
+		if batch.shape[2] > 3:
+			transparent = batch[:, :, 3] < 128
+		else:
+			transparent = np.zeros(batch.shape[0:2], dtype=bool)
+		threecolor = transparent.any(axis=1)
+		opaque = (~transparent).astype(np.float32)
+
+		# principal axis of the opaque pixels by power iteration on the covariance matrix
+		mean = (pixels * opaque[:, :, np.newaxis]).sum(axis=1) / np.maximum(opaque.sum(axis=1), 1.0)[:, np.newaxis]
+		centered = (pixels - mean[:, np.newaxis, :]) * opaque[:, :, np.newaxis]
+		covariance = np.einsum('nki,nkj->nij', centered, centered)
+		axis = covariance[np.arange(batch.shape[0]), covariance.diagonal(axis1=1, axis2=2).argmax(axis=1)]
+		for i in range(8):
+			axis = np.einsum('nij,nj->ni', covariance, axis)
+			axis /= np.maximum(np.sqrt((axis ** 2).sum(axis=1)), 1e-12)[:, np.newaxis]
+		projection = (centered * axis[:, np.newaxis, :]).sum(axis=2)
+		tmax = np.where(transparent, -np.inf, projection).max(axis=1)
+		tmin = np.where(transparent, np.inf, projection).min(axis=1)
+		tmax = np.where(np.isfinite(tmax), tmax, 0.0)[:, np.newaxis]
+		tmin = np.where(np.isfinite(tmin), tmin, 0.0)[:, np.newaxis]
+		color0, color1, indices, errors = fitDXT1Indices(pixels, opaque, pack565(mean + tmax * axis),
+														 pack565(mean + tmin * axis), threecolor)
+
+		# least squares refit of the endpoints to the selected indices, kept only where it lowers the error
+		weight0 = np.where(threecolor[:, np.newaxis], np.array([1.0, 0.0, 0.5, 0.0], dtype=np.float32)[indices],
+						   np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)[indices])
+		for i in range(refinements):
+			weight1 = (1.0 - weight0) * opaque
+			weight0 = weight0 * opaque
+			aa = (weight0 * weight0).sum(axis=1)
+			ab = (weight0 * weight1).sum(axis=1)
+			bb = (weight1 * weight1).sum(axis=1)
+			ap = (weight0[:, :, np.newaxis] * pixels).sum(axis=1)
+			bp = (weight1[:, :, np.newaxis] * pixels).sum(axis=1)
+			det = aa * bb - ab * ab
+			solvable = np.abs(det) > 1e-6
+			det = np.where(solvable, det, 1.0)[:, np.newaxis]
+			fit0 = (bb[:, np.newaxis] * ap - ab[:, np.newaxis] * bp) / det
+			fit1 = (aa[:, np.newaxis] * bp - ab[:, np.newaxis] * ap) / det
+			newcolor0, newcolor1, newindices, newerrors = fitDXT1Indices(pixels, opaque, pack565(fit0), pack565(fit1),
+																		 threecolor)
+			better = solvable & (newerrors < errors)
+			color0 = np.where(better, newcolor0, color0)
+			color1 = np.where(better, newcolor1, color1)
+			indices = np.where(better[:, np.newaxis], newindices, indices)
+			errors = np.where(better, newerrors, errors)
+			weight0 = np.where(threecolor[:, np.newaxis], np.array([1.0, 0.0, 0.5, 0.0], dtype=np.float32)[indices],
+							   np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)[indices])
+
+		# flat blocks are matched exactly through the interpolated palette entry
+		flat = np.rint(np.clip(mean, 0, 255)).astype(np.int32)
+		single = (DXT1_SINGLE5[flat[:, 0]] << 11) | (DXT1_SINGLE6[flat[:, 1]] << 5) | DXT1_SINGLE5[flat[:, 2]]
+		newcolor0, newcolor1, newindices, newerrors = fitDXT1Indices(pixels, opaque, single[:, 0], single[:, 1],
+																	 threecolor)
+		better = newerrors < errors
+		color0 = np.where(better, newcolor0, color0)
+		color1 = np.where(better, newcolor1, color1)
+		indices = np.where(better[:, np.newaxis], newindices, indices)
+
+		indices = np.where(transparent, 3, indices)
+		encoded['c0'][start:start + batchsize] = color0
+		encoded['c1'][start:start + batchsize] = color1
+		encoded['bits'][start:start + batchsize] = (indices.astype(np.uint32) << np.arange(0, 32, 2, dtype=np.uint32)).sum(
+			axis=1, dtype=np.uint32)
+	return encoded.view(np.uint8).reshape(numblocks, 8)
+
+
+def numpyImageToBlocks(image):  # (height, width, channels) image to (n, 16, channels) 4x4 blocks in row major order
+	height, width, channels = image.shape
+	return image.reshape(height / 4, 4, width / 4, 4, channels).swapaxes(1, 2).reshape(-1, 16, channels)
+
+
+def numpyMipChain(image, levels):  # the image and levels-1 2x2 box filtered mip levels below it
+	mips = [image]
+	for i in range(levels - 1):
+		prev = mips[-1].astype(np.uint16)
+		mip = (prev[0::2, 0::2] + prev[1::2, 0::2] + prev[0::2, 1::2] + prev[1::2, 1::2] + 2) // 4
+		mips.append(mip.astype(np.uint8))
+	return mips
+
+
+def numpyEncodeDDS(image, levels):  # DXT1 compresses an image and its mip chain, returns the data of a .dds without the header
+	return ''.join([numpyEncodeDXT1(numpyImageToBlocks(mip)).tobytes() for mip in numpyMipChain(image, levels)])
 
 
 def unpack_null_terminated_string(data, offset):
@@ -189,6 +484,690 @@ def unpack_null_terminated_string(data, offset):
 			return result
 
 
+def chunkTiles(ddsdata):  # cuts the 4 level dxt1 mip chain of a 1024x1024 chunk into an (1024, 680) uint8 array of tiles
+	# tile 32 * x + y is made of the 8x8 main level blocks at x, y followed by the 4x4, 2x2 and 1x1 blocks of its mips
+	ddsblocks = np.frombuffer(ddsdata, dtype=np.uint8, count=(524288 + 131072 + 32768 + 8192))
+	levels = []
+	sourceoffset = 0
+	for i in range(4):  # main + 3 mips
+		blocksperside = 256 >> i
+		blockspertile = 8 >> i
+		level = ddsblocks[sourceoffset:sourceoffset + blocksperside * blocksperside * 8]
+		level = level.reshape(32, blockspertile, 32, blockspertile, 8)  # tile y, block y, tile x, block x, bytes
+		levels.append(level.transpose(2, 0, 1, 3, 4).reshape(1024, blockspertile * blockspertile * 8))
+		sourceoffset += blocksperside * blocksperside * 8
+	return np.concatenate(levels, axis=1)
+
+
+def chunkTileTable(ddsdata):  # cuts the dds data of a 1024x1024 chunk into its 32x32 tiles, deduplicated within the chunk
+	# returns the unique tiles in first seen order as an (n, 680) array, and the local index of each tile position
+	tiles = chunkTiles(ddsdata)
+	uniquetiles, firstseen, inverse = np.unique(tiles.view(np.dtype((np.void, SMALL_TILE_SIZE))).ravel(),
+												 return_index=True, return_inverse=True)
+	order = np.argsort(firstseen)
+	localindex = np.empty_like(order)
+	localindex[order] = np.arange(order.shape[0])
+	return tiles[firstseen[order]], localindex[inverse.ravel()]
+
+
+workertexture = None
+
+
+def initChunkWorker(sharedtexture, shape):  # pool initializer, views the shared texture as a numpy array in each worker
+	global workertexture
+	workertexture = np.frombuffer(sharedtexture, dtype=np.uint8).reshape(shape)
+
+
+def encodeChunk(newtile):  # compresses a 1024x1024 chunk with its 4 level mip chain in memory, and cuts it into tiles
+	return chunkTileTable(numpyEncodeDDS(np.ascontiguousarray(newtile), 4))
+
+
+def encodeSharedChunk(chunk):  # worker job: crops, compresses and cuts one 1024x1024 chunk of the shared texture
+	tilex, tiley = chunk
+	return encodeChunk(workertexture[1024 * tiley:1024 * (tiley + 1), 1024 * tilex:1024 * (tilex + 1)])
+
+
+def mapBMP(filename, mode):  # memory maps the pixel rows of an uncompressed 24 or 32 bit .bmp file
+	# returns a function reading rows [top, top + count) as an RGB(A) array, or None if the file cannot be mapped
+	header = open(filename, 'rb').read(70)
+	if len(header) < 54 or header[0:2] != 'BM':
+		return None
+	dataoffset = struct.unpack_from('<I', header, 10)[0]
+	width, height, planes, bitcount, compression = struct.unpack_from('<iiHHI', header, 18)
+	if bitcount not in (24, 32) or compression not in (0, 3):
+		return None
+	if compression == 3 and (len(header) < 66 or struct.unpack_from('<III', header, 54) != (0xff0000, 0xff00, 0xff)):
+		return None
+	channels = bitcount / 8
+	order = [2, 1, 0]  # bmp pixels are stored as BGR(A)
+	if channels == 4 and mode == 'RGBA':
+		order.append(3)
+	rowbytes = (width * channels + 3) & ~3
+	rows = np.memmap(filename, dtype=np.uint8, mode='r', offset=dataoffset, shape=(abs(height), rowbytes))
+
+	def readRows(top, count):
+		if height > 0:  # bottom up, the usual case
+			band = rows[height - top - count:height - top][::-1]
+		else:
+			band = rows[top:top + count]
+		return np.asarray(band)[:, 0:width * channels].reshape(count, width, channels)[:, :, order]  # a writeable copy
+
+	return readRows
+
+
+def streamBMP(filename, width, height, bands):  # writes bands of RGB rows as a top down 24 bit .bmp as they come
+	rowbytes = (width * 3 + 3) & ~3
+	bmpfile = open(filename, 'wb')
+	bmpfile.write(struct.pack('<2sIHHI', 'BM', 54 + rowbytes * height, 0, 0, 54))
+	bmpfile.write(struct.pack('<IiiHHIIiiII', 40, width, -height, 1, 24, 0, rowbytes * height, 2835, 2835, 0, 0))
+	for band in bands:
+		rows = np.zeros((band.shape[0], rowbytes), dtype=np.uint8)
+		rows[:, 0:width * 3] = band[:, :, ::-1].reshape(band.shape[0], width * 3)  # bmp pixels are stored as BGR
+		rows.tofile(bmpfile)
+	bmpfile.close()
+
+
+def streamTexture(filename, bandheight=1024):  # yields the texture as writeable bands of bandheight rows
+	# uncompressed .bmp files are memory mapped so only one band is ever resident, anything else has to be loaded whole
+	image = Image.open(filename)
+	width, height = image.size
+	readRows = mapBMP(filename, image.mode)
+	if readRows is None:
+		print 'Warning: %s is not an uncompressed 24 or 32 bit .bmp, it cannot be streamed and will be loaded whole' % (
+			filename)
+		image.load()
+	mode = 'RGBA' if image.mode == 'RGBA' else 'RGB'
+	for top in range(0, height, bandheight):
+		if readRows is None:
+			yield np.array(image.crop((0, top, width, top + bandheight)).convert(mode))
+		else:
+			yield readRows(top, bandheight)
+
+
+def stampDecal(band, top, decal, mask, stamps):  # draws the masked pixels of decal onto a band of rows starting at row top
+	# stamps are the (left, upper) texture positions of each decal, parts falling outside the band are clipped
+	height, width = band.shape[0:2]
+	decalheight, decalwidth = mask.shape
+	for left, upper in stamps:
+		upper -= top
+		x0, y0 = max(left, 0), max(upper, 0)
+		x1, y1 = min(left + decalwidth, width), min(upper + decalheight, height)
+		if x0 >= x1 or y0 >= y1:
+			continue
+		region = band[y0:y1, x0:x1]
+		patch = mask[y0 - upper:y1 - upper, x0 - left:x1 - left]
+		region[patch, 0:3] = decal[y0 - upper:y1 - upper, x0 - left:x1 - left][patch]
+		if band.shape[2] == 4:
+			region[patch, 3] = 255
+
+
+def accumulateMinimap(sums, band, top, factory):  # adds a band of texture rows to the box filter sums of the minimap
+	# each minimap pixel covers factory rows, which do not have to line up with the band edges
+	factorx = band.shape[1] / sums.shape[1]
+	columns = band[:, :, 0:3].reshape(band.shape[0], sums.shape[1], factorx, 3).sum(axis=2, dtype=np.uint32)
+	rows = (top + np.arange(band.shape[0])) / factory
+	starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+	sums[rows[starts]] += np.add.reduceat(columns, starts, axis=0)
+
+
+def loadHeightmap(filename, mapx, mapy):  # loads a heightmap as a (mapy + 1, mapx + 1) array without quantizing it
+	# 16 bit .png/.tif/.raw and 8 bit images give uint16 levels, float32 .raw/.tif and float .npy give float heights in elmos
+	# prints what is wrong and returns None if the heightmap cannot be used
+	springmapx, springmapy = mapx / 64, mapy / 64
+	shape = (mapy + 1, mapx + 1)
+	sizeerror = 'Error: Incorrect %s heightmap dimensions of (%ix%i), image size should be exactly %ix%i for a spring map size of (%ix%i)'
+	lowername = filename.lower()
+	if '.raw' in lowername:
+		expectedheightmapsize = (mapx + 1) * (mapy + 1) * 2
+		if os.path.getsize(filename) == 2 * expectedheightmapsize:
+			print 'Heightmap %s is the size of a float32 .raw, reading it as heights in elmos' % (filename)
+			return np.memmap(filename, dtype='<f4', mode='r', shape=shape)
+		if os.path.getsize(filename) != expectedheightmapsize:
+			print 'Error: Incorrect %s heightmap dimensions, file size should be exactly %i (%ix%i) for a spring map size of (%ix%i)' % (
+				filename, expectedheightmapsize, mapx + 1, mapy + 1, springmapx, springmapy)
+			return None
+		heights = np.memmap(filename, dtype='<u2', mode='r', shape=shape)
+	elif '.npy' in lowername:
+		heights = np.load(filename, mmap_mode='r')
+		if heights.shape != shape:
+			print sizeerror % (filename, heights.shape[-1], heights.shape[0], mapx + 1, mapy + 1, springmapx, springmapy)
+			return None
+		if heights.dtype.kind == 'f':
+			return heights
+		if heights.dtype != np.uint16:
+			print 'Error: heightmap %s must be a float or uint16 array, instead it is %s' % (filename, heights.dtype)
+			return None
+	elif '.tif' in lowername and Image.open(filename).mode in ('F', 'I;16', 'I;16L', 'I;16B'):
+		tifheight = Image.open(filename)
+		if tifheight.size != (mapx + 1, mapy + 1):
+			print sizeerror % (filename, tifheight.size[0], tifheight.size[1], mapx + 1, mapy + 1, springmapx, springmapy)
+			return None
+		if tifheight.mode == 'F':
+			return np.asarray(tifheight)
+		heights = np.asarray(tifheight).astype(np.uint16)
+	elif '.png' in lowername:
+		pngheight = png.Reader(filename=filename)
+		pngheight.preamble()  # only the header is parsed by png.py, the pixels are decoded by PIL
+		if (pngheight.width, pngheight.height) != (mapx + 1, mapy + 1):
+			print sizeerror % (filename, pngheight.width, pngheight.height, mapx + 1, mapy + 1, springmapx, springmapy)
+			return None
+		if pngheight.bitdepth != 16:
+			print 'Error: heightmap %s must be 16 bit depth, instead it is %i. Dont use .png for 8 bit heightmaps, use .bmp!' % (
+				filename, pngheight.bitdepth)
+			return None
+		if pngheight.greyscale == False:
+			print 'Error: heightmap %s must be greyscale!' % (filename)
+			return None
+		if pngheight.alpha == True:
+			print 'Error: heightmap %s must not contain an alpha channel!' % (filename)
+			return None
+		heights = np.asarray(Image.open(filename)).astype(np.uint16)
+	else:
+		print 'Warning: you are using an 8-bit heightmap. This will most likely result in terracing effects, so consider switching to 16-bit depth .png or using --deterrace!'
+		otherheight = Image.open(filename)
+		if otherheight.size != (mapx + 1, mapy + 1):
+			print sizeerror % (filename, otherheight.size[0], otherheight.size[1], mapx + 1, mapy + 1, springmapx, springmapy)
+			return None
+		heights = (np.asarray(otherheight.convert('RGB'), dtype=np.uint32).sum(axis=2) * 256 / 3).astype(np.uint16)
+		return heights
+
+	# do a check to make sure the full 16-bit range of heights are used!
+	heightlevels = np.count_nonzero(np.bincount(heights.ravel(), minlength=65536))
+	print 'You are using %i unique height levels in your heightmap.' % (heightlevels)
+	if heightlevels <= 256:
+		print 'Warning: Even though you have specified a 16-bit heightmap, you are only using %i unique height levels.' % (heightlevels)
+		print 'Warning: This may result in terracing, consider using some surface blur on your heightmap (or --deterrace) to utilize full 16-bit depth!'
+	return heights
+
+
+def quantizeHeightmap(heights, minheight, maxheight, autorange, bandheight=256):  # turns loaded heights into uint16 levels
+	# float heights are in elmos and are mapped from minheight..maxheight, uint16 levels are kept as they are
+	# autorange fits minheight and maxheight to the lowest and highest point and stretches that over 0..65535
+	# works in bands of rows, so a float heightmap never gets a second full size float copy
+	# returns the uint16 levels with the minheight and maxheight they now span
+	isfloat = heights.dtype.kind == 'f'
+	if not autorange and not isfloat:
+		return heights, minheight, maxheight
+	if autorange:
+		low = min(np.nanmin(heights[top:top + bandheight]) for top in range(0, heights.shape[0], bandheight))
+		high = max(np.nanmax(heights[top:top + bandheight]) for top in range(0, heights.shape[0], bandheight))
+		if isfloat:
+			minheight, maxheight = float(low), float(high)
+		else:
+			levelheight = (maxheight - minheight) / 65535.0
+			minheight, maxheight = minheight + low * levelheight, minheight + high * levelheight
+		if high <= low:  # a flat map still needs a height range
+			high = low + 1
+			maxheight = minheight + 1.0
+		print 'Fitted the heightmap range to minheight %f and maxheight %f' % (minheight, maxheight)
+	else:
+		low, high = minheight, maxheight
+	scale = 65535.0 / (float(high) - float(low))
+	levels = np.empty(heights.shape, dtype=np.uint16)
+	clipped = 0
+	missing = 0
+	for top in range(0, heights.shape[0], bandheight):
+		band = (heights[top:top + bandheight].astype(np.float64) - low) * scale
+		nans = np.isnan(band)
+		if nans.any():
+			missing += np.count_nonzero(nans)
+			band[nans] = 0
+		clipped += np.count_nonzero((band < -0.5) | (band > 65535.5))
+		levels[top:top + bandheight] = np.clip(np.rint(band), 0, 65535)
+	if missing > 0:
+		print 'Warning: %i heightmap samples are not a number, they were set to the minheight' % (missing)
+	if clipped > 0:
+		print 'Warning: %i heightmap samples were outside the minheight..maxheight range of %f..%f and were clipped, consider using --autorange' % (
+			clipped, minheight, maxheight)
+	return levels, minheight, maxheight
+
+
+def gaussianKernel(size):  # normalized 1D gaussian weights of size taps (rounded up to odd), about +-3 sigma wide
+	radius = size / 2
+	sigma = max(size / 6.0, 0.5)
+	weights = np.exp(-np.arange(-radius, radius + 1) ** 2 / (2.0 * sigma * sigma))
+	return weights / weights.sum()
+
+
+def blurBand(levels, top, bottom, kernel):  # separable blur of rows top..bottom, reading a halo of rows around them
+	# edges are extended by repeating the border samples, returns float64 rows
+	radius = len(kernel) / 2
+	rows = np.clip(np.arange(top - radius, bottom + radius), 0, levels.shape[0] - 1)
+	band = np.pad(levels[rows].astype(np.float64), ((0, 0), (radius, radius)), 'edge')
+	width = levels.shape[1]
+	horizontal = sum(weight * band[:, tap:tap + width] for tap, weight in enumerate(kernel))
+	return sum(weight * horizontal[tap:tap + bottom - top] for tap, weight in enumerate(kernel))
+
+
+def filterHeightmap(levels, lowpass, deterrace, invert, bandheight=256):  # optional heightmap processing on uint16 levels
+	# deterrace blurs with a gaussian of deterrace taps, but keeps each sample within half a level step of where it was,
+	# so the steps of 8 bit or otherwise quantized heightmaps become slopes without moving the terrain itself
+	# lowpass smoothes with a gaussian of lowpass taps, invert flips the heightmap upside down
+	# every filter works in bands of rows, so only band sized float temporaries exist
+	height = levels.shape[0]
+	if deterrace > 0:
+		used = np.flatnonzero(np.bincount(levels.ravel(), minlength=65536))
+		step = np.median(np.diff(used)) if len(used) > 1 else 1
+		if step <= 1:
+			print 'Heightmap already uses every level in its range, there are no terraces to remove'
+		else:
+			print 'De-terracing heightmap levels spaced %i apart with a gaussian kernel size of %i' % (step, deterrace)
+			kernel = gaussianKernel(deterrace)
+			filtered = np.empty(levels.shape, dtype=np.uint16)
+			for top in range(0, height, bandheight):
+				bottom = min(top + bandheight, height)
+				original = levels[top:bottom].astype(np.float64)
+				blurred = np.clip(blurBand(levels, top, bottom, kernel), original - step / 2.0, original + step / 2.0)
+				filtered[top:bottom] = np.clip(np.rint(blurred), 0, 65535)
+			levels = filtered
+			print 'The heightmap now uses %i unique height levels' % (np.count_nonzero(np.bincount(levels.ravel())))
+	if lowpass > 1:
+		print 'Smoothing heightmap with a gaussian kernel size of %i' % (lowpass)
+		kernel = gaussianKernel(lowpass)
+		filtered = np.empty(levels.shape, dtype=np.uint16)
+		for top in range(0, height, bandheight):
+			bottom = min(top + bandheight, height)
+			filtered[top:bottom] = np.clip(np.rint(blurBand(levels, top, bottom, kernel)), 0, 65535)
+		levels = filtered
+	if invert:
+		print 'Flipping heightmap upside down'
+		levels = levels[::-1]
+	return levels
+
+
+def sampleHeightmap(levels, x, z, minheight, maxheight):  # bilinear ground height in elmos at elmo positions x, z
+	# heightmap vertices are 8 elmos apart, positions off the map are clamped to its edge
+	gridx = np.clip(np.asarray(x, dtype=np.float64) / 8.0, 0, levels.shape[1] - 1)
+	gridz = np.clip(np.asarray(z, dtype=np.float64) / 8.0, 0, levels.shape[0] - 1)
+	left = np.minimum(gridx.astype(np.int64), levels.shape[1] - 2)
+	top = np.minimum(gridz.astype(np.int64), levels.shape[0] - 2)
+	fx = gridx - left
+	fz = gridz - top
+	upper = levels[top, left] * (1 - fx) + levels[top, left + 1] * fx
+	lower = levels[top + 1, left] * (1 - fx) + levels[top + 1, left + 1] * fx
+	return minheight + (upper * (1 - fz) + lower * fz) * ((maxheight - minheight) / 65535.0)
+
+
+def poissonScatter(density, spacing, width, height, randomstate, rounds=10):  # positions no closer than spacing over width x height elmos
+	# density is a 2D array of 0..1 chances stretched over the area, used to thin the full poisson disk set
+	# darts are thrown on a grid of spacing / sqrt(2) cells that hold one point each, in 9 phases of cells 3 apart,
+	# so that the darts of a phase can never conflict with each other and all of them are tested at once
+	# returns the x and z arrays of the positions
+	cellsize = spacing / math.sqrt(2)
+	cellsx = int(math.ceil(width / cellsize))
+	cellsz = int(math.ceil(height / cellsize))
+	empty = 1e18  # far away from everything, so empty cells never conflict
+	mindistance = np.float32(spacing * spacing)
+	rowlength = cellsx + 4  # 2 cells of padding on every side so the neighbour lookups need no bounds checks
+	pointsx = np.empty((cellsz + 4) * rowlength, dtype=np.float32)
+	pointsx.fill(empty)
+	pointsz = pointsx.copy()
+	neighbours = [dz * rowlength + dx for dz in range(-2, 3) for dx in range(-2, 3) if (dz, dx) != (0, 0) and abs(dz * dx) != 4]
+
+	def densityAt(x, z):  # nearest pixel of the density map
+		rows = np.minimum((z * (density.shape[0] / float(height))).astype(np.int64), density.shape[0] - 1)
+		cols = np.minimum((x * (density.shape[1] / float(width))).astype(np.int64), density.shape[1] - 1)
+		return density[rows, cols]
+
+	phases = []
+	for phasez in range(3):
+		for phasex in range(3):
+			cellz, cellx = np.mgrid[phasez:cellsz:3, phasex:cellsx:3]
+			cellz, cellx = cellz.ravel(), cellx.ravel()
+			live = densityAt((cellx + 0.5) * cellsize, (cellz + 0.5) * cellsize) > 0  # no darts where nothing may grow
+			phases.append((cellz[live], cellx[live]))
+	for scatterround in range(rounds):
+		for phase, (cellz, cellx) in enumerate(phases):
+			vacant = np.take(pointsx, (cellz + 2) * rowlength + cellx + 2) == empty
+			cellz, cellx = cellz[vacant], cellx[vacant]
+			phases[phase] = (cellz, cellx)
+			cells = (cellz + 2) * rowlength + cellx + 2
+			x = ((cellx + randomstate.rand(len(cellx))) * cellsize).astype(np.float32)
+			z = ((cellz + randomstate.rand(len(cellz))) * cellsize).astype(np.float32)
+			accepted = (x < width) & (z < height)
+			for neighbour in neighbours:
+				accepted &= (np.take(pointsx, cells + neighbour) - x) ** 2 + (np.take(pointsz, cells + neighbour) - z) ** 2 >= mindistance
+			pointsx[cells[accepted]] = x[accepted]
+			pointsz[cells[accepted]] = z[accepted]
+	filled = pointsx != empty
+	x, z = pointsx[filled], pointsz[filled]
+	keep = randomstate.rand(len(x)) < densityAt(x, z)
+	return x[keep], z[keep]
+
+
+def loadScatterList(filename):  # reads a scatterlist, a 'featurename densitymap spacing [rotation]' line for each feature type to scatter
+	# returns a list of (featurename, densitymap, spacing, rotation) tuples, rotation -1 means random
+	scatterlist = []
+	for linenumber, line in enumerate(open(filename), 1):
+		line = line.split()
+		if len(line) == 0:
+			continue
+		try:
+			if len(line) < 3:
+				raise ValueError
+			scatterlist.append((line[0], line[1], float(line[2]), int(line[3]) if len(line) > 3 else -1))
+		except ValueError:
+			print 'Scatterlist: unable to parse line %i of %s, skipping it: %s' % (linenumber, filename, ' '.join(line))
+	return scatterlist
+
+
+def makeFeatures(types, x, z, y=0.0, rot=0.0, scale=1.0):  # builds an array of MapFeatureStructs from arrays or scalars
+	x = np.asarray(x)
+	features = np.empty(x.size, dtype=MapFeatureStruct_dtype)
+	features['type'] = types
+	features['x'] = x
+	features['y'] = y
+	features['z'] = z
+	features['rot'] = rot
+	features['scale'] = scale
+	return features
+
+
+featureplacement_re = re.compile(r'''(\w+)\s*=\s*(?:'([^']*)'|"([^"]*)"|([^,}\s]+))''')  # key = 'value', "value" or value
+# the usual line layout, as written by the decompiler, is matched in one go before falling back to featureplacement_re
+featureline_re = re.compile(
+	r'''\s*\{\s*name\s*=\s*(?:'([^']*)'|"([^"]*)")\s*,\s*x\s*=\s*([^,}\s]+)\s*,\s*z\s*=\s*([^,}\s]+)\s*,\s*rot\s*=\s*"?([^,}\s"]+)"?\s*(?:,\s*scale\s*=\s*([^,}\s]+)\s*)?\}''')
+featurefields = {'name': 0, 'x': 1, 'y': 2, 'z': 3, 'rot': 4, 'scale': 5}
+
+
+def loadFeaturePlacement(filename, featureTypeId):  # reads a featureplacement .lua, .csv or .npy file into MapFeatureStructs
+	# .lua files have a line like { name = 'agorm_talltree6', x = 224, z = 3616, rot = "0" , scale = 1.0}, per feature
+	# .csv files start with a header naming their columns, out of name, x, y, z, rot and scale
+	# .npy files hold a structured array with fields of those names
+	# name, x and z are required, feature types are numbered through featureTypeId, returns None if the file is unusable
+	lowername = filename.lower()
+	if lowername.endswith('.npy'):
+		records = np.load(filename)
+		if records.dtype.names is None or not set(['name', 'x', 'z']) <= set(records.dtype.names):
+			print 'Error: featureplacement %s must hold a structured array with at least name, x and z fields' % (filename)
+			return None
+		names, inverse = np.unique(records['name'], return_inverse=True)
+		typeids = np.array([featureTypeId(str(name).strip()) for name in names], dtype=np.int32)
+		optional = dict((field, records[field]) for field in ('y', 'rot', 'scale') if field in records.dtype.names)
+		return makeFeatures(typeids[inverse], records['x'], records['z'], **optional)
+
+	types = array.array('i')
+	columns = [array.array('f') for field in ('x', 'y', 'z', 'rot', 'scale')]
+	featurefile = open(filename)
+	iscsv = lowername.endswith('.csv')
+	if iscsv:
+		header = [featurefields.get(column.strip().lower(), -1) for column in featurefile.readline().split(',')]
+		if not set([0, 1, 3]) <= set(header):
+			print 'Error: the header of featureplacement %s must name at least the name, x and z columns' % (filename)
+			return None
+	for linenumber, line in enumerate(featurefile, 2 if iscsv else 1):
+		if iscsv:
+			cells = line.strip().split(',')
+			if cells == ['']:
+				continue
+			if len(cells) != len(header):
+				print 'Featureplacement: line %i of %s has %i columns instead of %i, skipping it' % (
+					linenumber, filename, len(cells), len(header))
+				continue
+			pairs = zip(header, cells)
+		else:
+			match = featureline_re.match(line)
+			if match:
+				single, double, x, z, rot, scale = match.groups()
+				pairs = ((0, single or double), (1, x), (3, z), (4, rot), (5, scale or '1'))
+			else:
+				pairs = [(featurefields[key.lower()], single or double or bare) for key, single, double, bare in
+						 featureplacement_re.findall(line.partition('--')[0]) if key.lower() in featurefields]
+				if not pairs:  # blank lines, comments and lua around the feature list
+					continue
+		feature = [None, None, 0.0, None, 0.0, 1.0]
+		try:
+			for field, value in pairs:
+				if field == 0:
+					feature[0] = value.strip()
+				elif field > 0:
+					feature[field] = float(value)
+		except ValueError:
+			print 'Featureplacement: unable to parse line %i of %s, %s is not a number: %s' % (
+				linenumber, filename, value, line.strip())
+			continue
+		if not feature[0] or feature[1] is None or feature[3] is None:
+			print 'Featureplacement: line %i of %s needs at least a name, x and z, skipping it: %s' % (
+				linenumber, filename, line.strip())
+			continue
+		types.append(featureTypeId(feature[0]))
+		for column, value in zip(columns, feature[1:]):
+			column.append(value)
+	x, y, z, rot, scale = [np.frombuffer(column, dtype=np.float32) if len(column) > 0 else np.zeros(0, dtype=np.float32)
+						   for column in columns]
+	return makeFeatures(np.frombuffer(types, dtype=np.int32) if len(types) > 0 else np.zeros(0, dtype=np.int32), x, z,
+						y=y, rot=rot, scale=scale)
+
+
+def loadFeatureList(filename, featureTypeId):  # reads a featurelist, a 'featurename [rotation]' line for each red value of the featuremap
+	# the first line is red 255, the second red 254 and so on, returns a list of (featurename, rotation) tuples
+	featurelist = []
+	for linenumber, line in enumerate(open(filename), 1):
+		line = line.split()
+		if len(line) == 0:
+			continue
+		featureTypeId(line[0])
+		rotation = 0
+		if len(line) > 1:
+			try:
+				rotation = int(line[1])
+			except ValueError:
+				print 'Featurelist: unable to parse the rotation on line %i of %s, using 0: %s' % (
+					linenumber, filename, ' '.join(line))
+		featurelist.append((line[0], rotation))
+	return featurelist
+
+
+def mapFile(filename):  # memory maps a whole file read only, the mapping stays valid after the file is closed
+	with open(filename, 'rb') as mappedfile:
+		return mmap.mmap(mappedfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def lazyproperty(function):  # a read only property that is computed on first access and then kept
+	name = '_' + function.__name__
+
+	def getter(self):
+		if not hasattr(self, name):
+			setattr(self, name, function(self))
+		return getattr(self, name)
+
+	return property(getter, doc=function.__doc__)
+
+
+def writeArray(fileobj, array, dtype):  # writes a whole map section as one contiguous buffer of the given (little endian) dtype
+	np.ascontiguousarray(array, dtype=dtype).tofile(fileobj)
+
+
+def runCommand(cmd, timeout):  # runs a shell command, killing it after timeout seconds
+	# returns the command, its exit code, its captured stderr and whether it timed out
+	# the shell and the compressor it starts get a process group of their own, so the whole group can be killed,
+	# killing just the shell would leave the compressor running with our pipes open
+	if os.name == 'nt':
+		process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+								   creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+	else:
+		process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+	timedout = []
+
+	def kill():
+		timedout.append(True)
+		try:
+			if os.name == 'nt':
+				subprocess.call('taskkill /T /F /PID %i' % (process.pid), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			else:
+				os.killpg(process.pid, signal.SIGKILL)
+		except OSError:  # it has just exited by itself
+			pass
+
+	timer = threading.Timer(timeout, kill)
+	timer.start()
+	try:
+		stdout, stderr = process.communicate()
+	finally:
+		timer.cancel()
+	return cmd, process.returncode, stderr, len(timedout) > 0
+
+
+def runCommands(commands, jobs, timeout):  # runs external commands with at most jobs of them at once, returns True if all succeeded
+	pool = multiprocessing.pool.ThreadPool(max(1, jobs))
+	failures = []
+	for i, (cmd, returncode, stderr, timedout) in enumerate(
+			pool.imap(lambda cmd: runCommand(cmd, timeout), commands)):
+		print i,
+		if timedout:
+			failures.append('Timed out after %i seconds: %s' % (timeout, cmd))
+		elif returncode != 0:
+			failures.append('Exit code %i from: %s\n%s' % (returncode, cmd, stderr.strip()))
+	print ''
+	pool.close()
+	pool.join()
+	for failure in failures:
+		print 'Error:', failure
+	return len(failures) == 0
+
+
+class SMTWriter:  # streams unique tiles into an .smt file in first seen order, deduplicating them by a 64 bit digest
+	def __init__(self, filename):
+		self.tilefile = open(filename, 'w+b')
+		self.tilefile.write(TileFileHeader_struct.pack('spring tilefile\0', 1, 0, 32, 1))  # numTiles is set by close()
+		self.numtiles = 0
+		self.collisions = 0
+		# open addressing hash table of tile digests to tile numbers, held in flat arrays instead of a dict of tiles
+		self.digests = np.zeros(1 << 16, dtype=np.int64)  # 0 marks an empty slot
+		self.tilenumbers = np.zeros(1 << 16, dtype=np.int32)
+
+	def addTile(self, tile):  # returns the number of the tile in the file, writing it if it was not seen before
+		digest = struct.unpack('<q', hashlib.md5(tile).digest()[0:8])[0] or 1
+		mask = self.digests.shape[0] - 1
+		slot = digest & mask
+		while self.digests[slot] != 0:
+			if self.digests[slot] == digest:
+				# a digest match is only a duplicate if the stored tile is really the same
+				tilenumber = int(self.tilenumbers[slot])
+				self.tilefile.seek(TileFileHeader_struct.size + tilenumber * SMALL_TILE_SIZE)
+				if self.tilefile.read(SMALL_TILE_SIZE) == tile:
+					self.tilefile.seek(0, 2)
+					return tilenumber
+				self.tilefile.seek(0, 2)
+				self.collisions += 1
+			slot = (slot + 1) & mask
+		self.digests[slot] = digest
+		self.tilenumbers[slot] = self.numtiles
+		self.tilefile.write(tile)
+		self.numtiles += 1
+		if self.numtiles * 2 > self.digests.shape[0]:
+			self.grow()
+		return self.numtiles - 1
+
+	def grow(self):  # doubles the hash table, reinserting every digest
+		digests, tilenumbers = self.digests, self.tilenumbers
+		self.digests = np.zeros(digests.shape[0] * 2, dtype=np.int64)
+		self.tilenumbers = np.zeros(digests.shape[0] * 2, dtype=np.int32)
+		mask = self.digests.shape[0] - 1
+		for digest, tilenumber in zip(digests[digests != 0].tolist(), tilenumbers[digests != 0].tolist()):
+			slot = digest & mask
+			while self.digests[slot] != 0:
+				slot = (slot + 1) & mask
+			self.digests[slot] = digest
+			self.tilenumbers[slot] = tilenumber
+
+	def close(self):
+		self.tilefile.seek(0)
+		self.tilefile.write(TileFileHeader_struct.pack('spring tilefile\0', 1, self.numtiles, 32, 1))
+		self.tilefile.close()
+
+
+class FeatureGrid:  # uniform grid over feature positions, each cell lists its features contiguously in placement order
+	def __init__(self, features, cellsize, width, height):
+		self.features = features
+		self.cellsize = float(cellsize)
+		self.cellsx = max(1, int(math.ceil(width / self.cellsize)))
+		self.cellsz = max(1, int(math.ceil(height / self.cellsize)))
+		self.cellx = np.clip(np.floor(features['x'] / self.cellsize), 0, self.cellsx - 1).astype(np.int64)
+		self.cellz = np.clip(np.floor(features['z'] / self.cellsize), 0, self.cellsz - 1).astype(np.int64)
+		self.cells = self.cellz * self.cellsx + self.cellx
+		self.order = np.argsort(self.cells, kind='mergesort')  # stable, so features stay in placement order in a cell
+		self.counts = np.bincount(self.cells, minlength=self.cellsx * self.cellsz)
+		self.starts = np.cumsum(self.counts) - self.counts
+		self.ranks = np.empty(len(features), dtype=np.int64)  # position of each feature within its cell
+		self.ranks[self.order] = np.arange(len(features)) - self.starts[self.cells[self.order]]
+
+	def mergeWithin(self, radius):  # returns a mask keeping one of any features of the same type closer than radius
+		# features are put in slots by type and cells radius / sqrt(2) wide, so any two in a slot are within radius and a
+		# slot keeps at most one. In each round the first undecided feature of every slot is a candidate, candidates are
+		# kept greedily in placement order, then every undecided feature within radius of a kept one is dropped. Only one
+		# candidate and one kept feature per slot are ever compared, so the work stays linear however many features are
+		# stacked in one spot, and placement order decides which one is kept.
+		x, z = self.features['x'], self.features['z']
+		slotsize = radius / math.sqrt(2.0)
+		cellsx = int(math.ceil(self.cellsx * self.cellsize / slotsize))
+		cellsz = int(math.ceil(self.cellsz * self.cellsize / slotsize))
+		cellx = np.clip(np.floor(x / slotsize), 0, cellsx - 1).astype(np.int64)
+		cellz = np.clip(np.floor(z / slotsize), 0, cellsz - 1).astype(np.int64)
+		keys, slotfirsts, slots = np.unique((self.features['type'].astype(np.int64) * cellsz + cellz) * cellsx + cellx,
+										return_index=True, return_inverse=True)
+		slots = slots.ravel()
+		slotx, slotz = cellx[slotfirsts], cellz[slotfirsts]
+		# the cells that can hold features within radius of a cell
+		offsets = [(dx, dz) for dz in range(-2, 3) for dx in range(-2, 3) if abs(dx) + abs(dz) < 4]
+
+		def neighbourSlots(slotlist, dx, dz):  # the slot of the same type in the cell offset from each slot, or len(keys)
+			wanted = keys[slotlist] + dz * cellsx + dx
+			found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+			inside = ((slotx[slotlist] + dx >= 0) & (slotx[slotlist] + dx < cellsx) &
+					  (slotz[slotlist] + dz >= 0) & (slotz[slotlist] + dz < cellsz) & (keys[found] == wanted))
+			return np.where(inside, found, len(keys))
+
+		occupants = np.full(len(keys) + 1, -1, dtype=np.int64)  # the kept feature of each slot, the last one stands for no slot
+		candidateof = np.full(len(keys) + 1, -1, dtype=np.int64)
+		keep = np.zeros(len(self.features), dtype=bool)
+		decided = np.zeros(len(self.features), dtype=bool)
+		undecided = np.arange(len(self.features))
+		while len(undecided) > 0:
+			candidateslots, firstundecided = np.unique(slots[undecided], return_index=True)
+			candidates = undecided[firstundecided]
+			candidateof[candidateslots] = candidates
+			firsts, seconds = [], []
+			for dx, dz in offsets:  # the earlier candidate of each neighbouring slot
+				others = candidateof[neighbourSlots(candidateslots, dx, dz)]
+				near = np.flatnonzero((others >= 0) & (others < candidates))
+				first, second = others[near], candidates[near]
+				close = (x[first] - x[second]) ** 2 + (z[first] - z[second]) ** 2 <= radius * radius
+				firsts.append(first[close])
+				seconds.append(second[close])
+			candidateof[candidateslots] = -1
+			firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+			keep[candidates] = True
+			decided[candidates] = True
+			# in order of the later candidate, each earlier one is already decided when its pairs come up
+			pairorder = np.lexsort((firsts, seconds))
+			for first, second in zip(firsts[pairorder].tolist(), seconds[pairorder].tolist()):
+				if keep[first]:
+					keep[second] = False
+			kept = candidates[keep[candidates]]
+			occupants[slots[kept]] = kept
+			undecided = undecided[~decided[undecided]]
+			undecidedslots = slots[undecided]
+			drop = occupants[undecidedslots] >= 0
+			for dx, dz in offsets:  # every feature within radius of a kept one is dropped
+				others = occupants[neighbourSlots(undecidedslots, dx, dz)]
+				near = np.flatnonzero(others >= 0)
+				close = ((x[others[near]] - x[undecided[near]]) ** 2 +
+						 (z[others[near]] - z[undecided[near]]) ** 2 <= radius * radius)
+				drop[near[close]] = True
+			undecided = undecided[~drop]
+		return keep
+
+	def capCells(self, cap):  # returns a mask keeping the first cap features of each cell
+		return self.ranks < cap
+
+	def densityStats(self):  # returns the number of occupied cells, and the mean, 99th percentile and max features per occupied cell
+		occupied = self.counts[self.counts > 0]
+		if len(occupied) == 0:
+			return 0, 0.0, 0, 0
+		return len(occupied), occupied.mean(), int(np.percentile(occupied, 99)), occupied.max()
+
+
 def compileSMF(myargs):
 	verbose = True
 
@@ -197,6 +1176,10 @@ def compileSMF(myargs):
 		print 'Please specify a name for the map!'
 		return
 
+	# a fixed seed makes the random parts of a build (grass from the featuremap, the map id) reproducible
+	random.seed(myargs.seed)
+	randomstate = np.random.RandomState(myargs.seed)
+
 	if '.smf' not in myargs.outfile:
 		myargs.outfile += '.smf'
 		print 'The .smf extension was omitted from the output file name, output will be:', myargs.outfile
@@ -204,7 +1187,6 @@ def compileSMF(myargs):
 	# open texture, get sizes
 	Image.MAX_IMAGE_PIXELS = None
 	intex = Image.open(myargs.intex)
-	intex_pixels = intex.load()
 	texw, texh = intex.size
 	mapx = texw / 8
 	mapy = texh / 8
@@ -226,64 +1208,15 @@ def compileSMF(myargs):
 		print 'Texture image %s is neither RGB nor RGBA, but is %s this may cause unexpected issues downstream!' % (
 		myargs.intex, intex.mode)
 	# open heightmap:
-	heights = []
-	if '.raw' in myargs.heightmap.lower():
-		rawheight = open(myargs.heightmap, 'rb').read()
-		expectedheightmapsize = (mapx + 1) * (mapy + 1) * 2
-		if len(rawheight) != expectedheightmapsize:
-			print 'Error: Incorrect %s heightmap dimensions, file size should be exactly %i (%ix%i) for a spring map size of (%ix%i)' % (
-				myargs.heightmap, expectedheightmapsize, mapx + 1, mapy + 1, springmapx, springmapy)
-			return
-		else:
-			heights = struct.unpack('< ' + 'H' * (expectedheightmapsize / 2), rawheight)
-	elif '.png' in myargs.heightmap.lower():
-
-		pngheight = png.Reader(
-			filename=myargs.heightmap)  # (32, 32, <itertools.imap object at 0x10b7eb0>, {'greyscale': True,'alpha': False, 'interlace': 0, 'bitdepth': 2, 'gamma': 1.0})
-		pngheight = pngheight.read()
-		if pngheight[0] * pngheight[1] != (mapx + 1) * (mapy + 1):
-			print 'Error: Incorrect %s heightmap dimensions of (%ix%i), image size should be exactly %ix%i for a spring map size of (%ix%i)' % (
-				myargs.heightmap, pngheight[0], pngheight[1], mapx + 1, mapy + 1, springmapx, springmapy)
-			return
-		if pngheight[3]['bitdepth'] != 16:
-			print 'Error: heightmap %s must be 16 bit depth, instead it is %i. Dont use .png for 8 bit heightmaps, use .bmp!' % (
-			myargs.heightmap, pngheight[3]['bitdepth'])
-			return
-		if pngheight[3]['greyscale'] == False:
-			print 'Error: heightmap %s must be greyscale!' % (myargs.heightmap)
-			return
-		if pngheight[3]['alpha'] == True:
-			print 'Error: heightmap %s must not contain an alpha channel!' % (myargs.heightmap)
-			return
-
-		# do a check to make sure the full 16-bit range of heights are used!
-		heightlevelshist = {}
-		for row in pngheight[2]:
-			for col in row:
-				heights.append(col)
-				if col in heightlevelshist:
-					heightlevelshist[col]+=1
-				else:
-					heightlevelshist[col]=1
-		print 'You are using %i unique height levels in your heightmap.' % (len(heightlevelshist))
-		if len(heightlevelshist) <= 256 :
-			print 'Warning: Even though you have specified a 16-bit heightmap, you are only using %i unique height levels.' % (len(heightlevelshist))
-			print 'Warning: This may result in terracing, consider using some surface blur on your heightmap to utilize full 16-bit depth!'
-		heightlevelshist = {}
-	else:
-		print 'Warning: you are using an 8-bit heightmap. This will most likely result in terracing effects, so consider switching to 16-bit depth .png!'
-		otherheight = Image.open(myargs.heightmap)
-		otherheight_pixels = otherheight.load()
-		if otherheight.size != (mapx + 1, mapy + 1):
-			print 'Error: Incorrect %s heightmap dimensions of (%ix%i), image size should be exactly %ix%i for a spring map size of (%ix%i)' % (
-				myargs.heightmap, otherheight.size[0], otherheight.size[1], mapx + 1, mapy + 1, springmapx, springmapy)
-			return
-		for row in range(otherheight.size[1]):
-			for col in range(otherheight.size[0]):
-				heights.append(sum(otherheight_pixels[col, row]) * 256 / 3)
+	heights = loadHeightmap(myargs.heightmap, mapx, mapy)
+	if heights is None:
+		return
+	heights, myargs.minheight, myargs.maxheight = quantizeHeightmap(heights, myargs.minheight, myargs.maxheight,
+																	myargs.autorange)
+	heights = filterHeightmap(heights, myargs.lowpass, myargs.deterrace, myargs.invert)
 
 	# open metalmap:
-	metalmap = []
+	metalmap = np.zeros((mapy / 2, mapx / 2), dtype=np.uint8)
 	if myargs.metalmap:
 		metalimage = Image.open(myargs.metalmap)
 		if metalimage.size != (mapx / 2, mapy / 2):
@@ -291,59 +1224,31 @@ def compileSMF(myargs):
 				myargs.metalmap, metalimage.size[0], metalimage.size[1], mapx / 2, mapy / 2, springmapx, springmapy)
 			print 'Rescaling metalmap %s to (%ix%i)' % (myargs.metalmap, mapx / 2, mapy / 2)
 			metalimage = metalimage.resize((mapx / 2, mapy / 2), Image.BILINEAR)
-		metalimage_pixels = metalimage.load()
-		for row in range(metalimage.size[1]):
-			for col in range(metalimage.size[0]):
-				metalmap.append(metalimage_pixels[col, row][0])
-	else:
-		metalmap = [0] * (mapy * mapx / 4)
-
-	# if myargs.invert:
-	#	print 'Flipping heightmap upside down is not implemented yet :('
-	# newheights=[]
+		metalmap[:] = np.asarray(metalimage.convert('RGB'))[:, :, 0]
 
 	# load features from featureplacement;
 	featuretypes = ['TreeType0', 'TreeType1', 'TreeType2', 'TreeType3', 'TreeType4', 'TreeType5', 'TreeType6',
 					'TreeType7', 'TreeType8', 'TreeType9', 'TreeType10', 'TreeType11', 'TreeType12', 'TreeType13',
 					'TreeType14', 'TreeType15', 'GeoVent']
-	featureplacement = []
+	featuretypeids = dict((featuretype, typeid) for typeid, featuretype in enumerate(featuretypes))
+
+	def featureTypeId(featuretype):  # returns the id of a feature type, adding it to the list of types if it is new
+		if featuretype not in featuretypeids:
+			featuretypeids[featuretype] = len(featuretypes)
+			featuretypes.append(featuretype)
+		return featuretypeids[featuretype]
+
+	featureblocks = []  # arrays of MapFeatureStructs, concatenated once all features are placed
 	if myargs.featureplacement:
-		for line in open(myargs.featureplacement).readlines():
-			line = line.strip().split(',')
-			if len(line) < 3:
-				continue
-			myfeature = {'name': '', 'x': 0.0, 'y': 0.0, 'z': 0.0, 'rot': 0.0, 'scale': 1.0}
-			for block in line:
-				if '=' in block:
-					block = block.partition('=')
-					key = block[0].strip(' {}\'\"').lower()
-					val = block[2].strip(' {}\'\"')
-					if key == 'name':
-						myfeature[key] = val
-						if val not in featuretypes:
-							featuretypes.append(val)
-					elif key in myfeature:
-						try:
-							myfeature[key] = float(val)
-						except ValueError:
-							print 'Featureplacement: unable to parse line %s for floats at %s' % (str(line), key)
-			featureplacement.append(myfeature)
+		featureblocks.append(loadFeaturePlacement(myargs.featureplacement, featureTypeId))
+		if featureblocks[-1] is None:
+			return
 
 	# load features from featuremap
 	featurelist = []
 	if myargs.featurelist:
-		for line in open(myargs.featurelist).readlines():
-			line = line.split(' ')
-			if line[0] not in featuretypes:
-				featuretypes.append(line[0])
-			if len(line) > 1:
-				try:
-					featurelist.append((line[0], int(line[1])))
-				except ValueError:
-					print 'Failed to parse line %s in featurelist:' % (str(line))
-			else:
-				featurelist.append((line[0], 0))
-	vegmap = [0] * ((mapx / 4) * (mapy / 4))
+		featurelist = loadFeatureList(myargs.featurelist, featureTypeId)
+	vegmap = np.zeros((mapx / 4) * (mapy / 4), dtype=np.uint8)
 
 	if myargs.featuremap:
 		featuremap = Image.open(myargs.featuremap)
@@ -351,39 +1256,70 @@ def compileSMF(myargs):
 			print 'Error: Incorrect %s featuremap dimensions of (%ix%i), image size should be exactly %ix%i for a spring map size of (%ix%i)' % (
 				myargs.featuremap, featuremap.size[0], featuremap.size[1], mapx, mapy, springmapx, springmapy)
 			return
-		featuremap_pixels = featuremap.load()
-		for row in range(featuremap.size[1]):
-			for col in range(featuremap.size[0]):
-				pixel = featuremap_pixels[col, row]
-				if col % 2 and row % 2:  # grass at half rez
-					if random.randint(0, 255) < pixel[2]:
-						vegmap[(mapx / 4) * row + col] = 1
-
-				if pixel[1] == 255:  # geovent
-					featureplacement.append(
-						{'name': 'Geovent', 'x': 8.0 * col + 4, 'y': 0.0, 'z': 8.0 * col + 4, 'rot': 0.0, 'scale': 1.0})
-					print 'Placed Geovent: %s' % (str(featureplacement[-1]))
-				elif pixel[1] < 216 and pixel[1] > 199:
-					featureplacement.append(
-						{'name': 'TreeType%i' % (pixel[1] - 200), 'x': 8.0 * col + 4, 'y': 0.0, 'z': 8.0 * col + 4,
-						 'rot': 0.0, 'scale': 1.0})
-				elif pixel[1] != 0:
-					print 'Undefined green pixel of value %i at %i x %i in %s. Not placing anything'
-				if pixel[0] > 0:
-					try:
-						featureplacement.append(
-							{'name': featurelist[255 - pixel[0]][0], 'x': 8.0 * col + 4, 'y': 0.0, 'z': 8.0 * col + 4,
-							 'rot': featuretypes[255 - pixel[0]][1], 'scale': 1.0})
-					except IndexError:
-						print 'Unable to find a featurename in featurelist for red pixel value %i at %ix%i in featuremap!' % (
-						pixel[0], col, row)
+		featuremap_pixels = np.asarray(featuremap.convert('RGB'))
+		# grass: each vegmap square covers 4x4 featuremap pixels, whose mean blue is the chance of grass growing there
+		grasschance = featuremap_pixels[:, :, 2].reshape(mapy / 4, 4, mapx / 4, 4).mean(axis=(1, 3))
+		vegmap[(randomstate.randint(0, 256, size=grasschance.shape) < grasschance).ravel()] = 1
+
+		green = featuremap_pixels[:, :, 1]
+		rows, cols = np.nonzero(green == 255)  # geovents
+		for row, col in zip(rows, cols):
+			print 'Placed GeoVent at %ix%i' % (8 * col + 4, 8 * row + 4)
+		featureblocks.append(makeFeatures(featuretypeids['GeoVent'], 8.0 * cols + 4, 8.0 * rows + 4))
+		rows, cols = np.nonzero((green > 199) & (green < 216))  # trees, TreeType0 is green 200
+		featureblocks.append(makeFeatures(green[rows, cols].astype(np.int32) - 200, 8.0 * cols + 4, 8.0 * rows + 4))
+		rows, cols = np.nonzero((green != 0) & (green != 255) & ((green < 200) | (green > 215)))
+		if len(rows) > 0:
+			print 'Undefined green pixel of value %i at %i x %i in %s (and %i more). Not placing anything' % (
+				green[rows[0], cols[0]], cols[0], rows[0], myargs.featuremap, len(rows) - 1)
+
+		red = featuremap_pixels[:, :, 0]
+		rows, cols = np.nonzero(red)  # red 255 is the first line of the featurelist, 254 the second and so on
+		listindices = 255 - red[rows, cols].astype(np.int32)
+		missing = listindices >= len(featurelist)
+		for row, col in zip(rows[missing], cols[missing]):
+			print 'Unable to find a featurename in featurelist for red pixel value %i at %ix%i in featuremap!' % (
+			red[row, col], col, row)
+		rows, cols, listindices = rows[~missing], cols[~missing], listindices[~missing]
+		listtypes = np.array([featureTypeId(name) for name, rotation in featurelist], dtype=np.int32)
+		listrotations = np.array([rotation for name, rotation in featurelist], dtype=np.int32)
+		rotations = listrotations[listindices]
+		randomrotations = rotations == -1
+		rotations[randomrotations] = randomstate.randint(-32768, 32768, np.count_nonzero(randomrotations))
+		featureblocks.append(makeFeatures(listtypes[listindices], 8.0 * cols + 4, 8.0 * rows + 4, rot=rotations))
+	if myargs.scatterlist:
+		for featurename, densitymap, spacing, rotation in loadScatterList(myargs.scatterlist):
+			density = np.asarray(Image.open(densitymap).convert('L'), dtype=np.float32) / 255.0
+			x, z = poissonScatter(density, spacing, mapx * 8, mapy * 8, randomstate)
+			if rotation == -1:
+				rotation = randomstate.randint(-32768, 32768, len(x))
+			featureblocks.append(makeFeatures(featureTypeId(featurename), x, z, rot=rotation))
+			print 'Scattered %i %s at least %f elmos apart, using the density map %s' % (len(x), featurename, spacing, densitymap)
+	features = np.concatenate(featureblocks) if featureblocks else np.zeros(0, dtype=MapFeatureStruct_dtype)
+	featureblocks = None
+	inside = (features['x'] >= 0) & (features['x'] < mapx * 8) & (features['z'] >= 0) & (features['z'] < mapy * 8)
+	if not inside.all():
+		print 'Removed %i features outside the %ix%i elmo map area' % (len(features) - np.count_nonzero(inside), mapx * 8, mapy * 8)
+		features = features[inside]
+	if myargs.featuremerge > 0:
+		keep = FeatureGrid(features, myargs.featurecell, mapx * 8, mapy * 8).mergeWithin(myargs.featuremerge)
+		print 'Merged %i features into another feature of the same type within %f elmos' % (
+			len(features) - np.count_nonzero(keep), myargs.featuremerge)
+		features = features[keep]
+	featuregrid = FeatureGrid(features, myargs.featurecell, mapx * 8, mapy * 8)
+	print 'Feature density in %ix%i elmo cells: %i cells occupied, %.2f mean, %i at the 99th percentile, %i max' % (
+		(myargs.featurecell, myargs.featurecell) + featuregrid.densityStats())
+	if myargs.featurecap > 0:
+		keep = featuregrid.capCells(myargs.featurecap)
+		print 'Removed %i features over the cap of %i per cell' % (len(features) - np.count_nonzero(keep), myargs.featurecap)
+		features = features[keep]
+	featuregrid = None
+	if myargs.groundheight:
+		print 'Setting the height of %i features to the ground height under them' % (len(features))
+		features['y'] = sampleHeightmap(heights, features['x'], features['z'], myargs.minheight, myargs.maxheight)
 	print 'Placed a total of %i features out of %i feature types (17 of which are built-in), with the following distribution:' % (
-	len(featureplacement), len(featuretypes))
-	for featuretype in featuretypes:
-		cnt = 0
-		for feature in featureplacement:
-			if feature['name'] == featuretype:
-				cnt += 1
+	len(features), len(featuretypes))
+	for featuretype, cnt in zip(featuretypes, np.bincount(features['type'], minlength=len(featuretypes))):
 		if cnt > 0:
 			print 'Placed %i %s' % (cnt, featuretype)
 
@@ -393,38 +1329,34 @@ def compileSMF(myargs):
 			print 'Error: Incorrect %s grassmap dimensions of (%ix%i), image size should be exactly %ix%i for a spring map size of (%ix%i)' % (
 				myargs.grassmap, grassmap.size[0], grassmap.size[1], mapx / 4, mapy / 4, springmapx, springmapy)
 			return
-		grassmap_pixels = grassmap.load()
-		for row in range(grassmap.size[1]):
-			for col in range(grassmap.size[0]):
-				if sum(grassmap_pixels[col, row]) != 0:
-					vegmap[(mapx / 4) * row + col] = 1
-	print 'Total grass coverage of map is %f percent' % (100.0 * sum(vegmap) / float(mapx * mapy / 16))
+		vegmap[np.asarray(grassmap.convert('RGB')).any(axis=2).ravel()] = 1
+	print 'Total grass coverage of map is %f percent' % (100.0 * np.count_nonzero(vegmap) / float(mapx * mapy / 16))
 	# actually load the texture image:
-
+	if myargs.stream:
+		print 'Streaming texture %s in bands of 1024 rows instead of loading it whole' % (myargs.intex)
+	else:
+		intex.load()
 
 	# draw geovent onto texture
+	geovents = []
 	if myargs.geoventfile:
-		geoventimg = Image.open(myargs.geoventfile)
-		geoventimg_pixels = geoventimg.load()
+		geoventimg = Image.open(myargs.geoventfile).convert('RGB')
 		if sum(geoventimg.size) > 1000:
 			print 'Warning: You have specified a very large %s geo vent file, are you sure this is what you desire?' % (
 			str(geoventimg.size))
-		for feature in featureplacement:
-			if feature['name'].lower() == 'geovent':
-				geovent_pixel_y = 0
-				for row in range(feature['z'] - geoventimg.size[1] / 2, feature['z'] + geoventimg.size[1] / 2, 1):
-					geovent_pixel_y += 1
-					geovent_pixel_x = 0
-					for col in range(feature['x'] - geoventimg.size[0] / 2, feature['z'] + geoventimg.size[0] / 2, 1):
-						geovent_pixel_x += 1
-						if sum(geoventimg_pixels[geovent_pixel_x, geovent_pixel_y]) != 3 * 255:
-							try:
-								intex_pixels[col, row] = geoventimg_pixels[geovent_pixel_x, geovent_pixel_y]
-							except IndexError:
-								print 'Warning: Failed to draw a geovent image pixel onto the main texture at %ix%i' % (
-								col, row)
-
-	typemap = [0] * (mapx / 2) * (mapy / 2)
+		geoventdecal = np.asarray(geoventimg)
+		geoventmask = (geoventdecal != 255).any(axis=2)  # all white is transparent
+		geoventtypes = [typeid for typeid, featuretype in enumerate(featuretypes) if featuretype.lower() == 'geovent']
+		geoventfeatures = features[np.in1d(features['type'], geoventtypes)]
+		geovents = zip(geoventfeatures['x'].astype(int) - geoventimg.size[0] / 2,
+					   geoventfeatures['z'].astype(int) - geoventimg.size[1] / 2)
+		if not myargs.stream:  # when streaming, the geovents are stamped onto each band as it is read instead
+			geoventmaskimg = Image.fromarray(geoventmask.astype(np.uint8) * 255)
+			for left, upper in geovents:
+				intex.paste(geoventimg, (left, upper), geoventmaskimg)
+			geovents = []
+
+	typemap = np.zeros((mapy / 2, mapx / 2), dtype=np.uint8)
 	if myargs.typemap:
 		print 'Loading typemap', myargs.typemap
 		typemap_img = Image.open(myargs.typemap)
@@ -433,124 +1365,196 @@ def compileSMF(myargs):
 				myargs.typemap, typemap_img.size[0], typemap_img.size[1], mapx / 2, mapy / 2, springmapx, springmapy)
 			return
 
-		typemap_img_pixel = typemap_img.load()
-		for row in range(typemap_img.size[1]):
-			for col in range(typemap_img.size[0]):
-				typemap[(mapx / 2) * row + col] = typemap_img_pixel[col, row][0]
+		typemap[:] = np.asarray(typemap_img.convert('RGB'))[:, :, 0]
 
-	# make 1024x1024 tiles for nvdxt:
-	try:
-		print 'Creating temp directory for intermediate tiles'
-		if not os.path.exists('temp'):
-			os.makedirs('temp')
-	except:
-		print 'Failed to create temp directory!'
-		pass
-	# todo: handle alpha in intex properly!
-	print 'Writing tiles',
-	extension = 'bmp'
-	if intex.mode == 'RGBA':
-		extension = 'tiff'
-	for tilex in range(springmapx / 2):
-		for tiley in range(springmapx / 2):
-			tileindex = tiley * (springmapx / 2) + tilex
-			newtile = intex.crop((1024 * tilex, 1024 * tiley, 1024 * (tilex + 1), 1024 * (
-			tiley + 1)))  # The box is a 4-tuple defining the left, upper, right, and lower pixel coordinate.
-			print tileindex,
-			newtile.save(os.path.join('temp', 'temp%i.%s' % (tileindex, extension)))
-	print ''
+	if not myargs.numpydxt:  # the external compressors need everything as files in the temp dir
+		try:
+			print 'Creating temp directory for intermediate tiles'
+			if not os.path.exists('temp'):
+				os.makedirs('temp')
+		except:
+			print 'Failed to create temp directory!'
+			pass
 
-	print 'Converting to dds',
-	if myargs.linux:
-		basecmd = 'convert -format dds -define dds:mipmaps=3 -define dds:compression=dxt1 temp/temp%i.%s temp/temp%i.dds'
-		print 'with the base command of:', basecmd
-		for tilex in range(springmapx / 2):
-			for tiley in range(springmapx / 2):
-				tileindex = tiley * (springmapx / 2) + tilex
-				cmd = basecmd % (tileindex, extension, tileindex)
-				os.system(cmd)
-				print tileindex,
-		print ''
-	else:
-		compressionmethod = 'dxt1c'
-		if intex.mode == 'RGBA':
-			compressionmethod = 'dxt1a'
-		cmd = 'nvdxt.exe -file temp\\temp*.%s -%s -outsamedir -nmips 4 %s' % (
-		extension, compressionmethod, myargs.nvdxt_options)
-		print 'with the command: ',cmd
-		os.system(cmd)
-
-	def ReadTile(xpos, ypos, sourcebuf):  # xpos and ypos aremultiples of 32
-		outtile = b''
-		sourceoffset = 0
-		for i in range(4):  # main + 3 mips
-			div = 1 << i
-			xp = 8 / div
-			yp = 8 / div
-			for y in range(yp):
-				for x in range(xp):
-					ptr = ((x + xpos / div / 4) + ((y + ypos / div / 4)) * (256 / (div))) * 8 + sourceoffset
-					outtile += sourcebuf[ptr:ptr + 8]
-			sourceoffset += 524288 / (1 << (i * 2))
-		return outtile
-
-	minimapfilename = os.path.join('temp', 'mini.png')
-	print 'Creating minimap', minimapfilename,'using the command:',
+	minimapsums = None
 	if myargs.minimap:
-		minimapfilename = myargs.minimap
+		mini = Image.open(myargs.minimap)
+	elif myargs.stream:  # the minimap is box filtered from the bands as they stream past
+		mini = None
+		minimapsums = np.zeros((1024, 1024, 3), dtype=np.uint32)
 	else:
 		mini = intex.resize((1024, 1024), Image.ANTIALIAS)
-		mini.save(minimapfilename)
-	if myargs.linux:
-		cmd = 'convert -format dds -define dds:mipmaps=8 -define dds:compression=dxt1 %s temp/mini.dds' % (
-		minimapfilename)
-		print cmd
-		os.system(cmd)
+
+	# the texture is processed in bands of 1024 rows, one row of 1024x1024 chunks at a time
+	if myargs.stream:
+		bands = streamTexture(myargs.intex, 1024)
 	else:
-		cmd = 'nvdxt.exe -file %s -dxt1c -nmips 9 -output temp/mini.dds -Sinc -quality_highest' % (minimapfilename)
-		print cmd
-		os.system(cmd)
-	minimapdata = open(os.path.join('temp', 'mini.dds'), 'rb').read()[128:]
+		bandmode = 'RGBA' if intex.mode == 'RGBA' else 'RGB'
+		bands = (np.array(intex.crop((0, 1024 * tiley, texw, 1024 * (tiley + 1))).convert(bandmode)) for tiley in
+				 range(springmapy / 2))
+
+	def preparedBands():  # stamps the geovents onto each band and adds it to the minimap as it streams past
+		for tiley, band in enumerate(bands):
+			if geovents:
+				stampDecal(band, 1024 * tiley, geoventdecal, geoventmask, geovents)
+			if minimapsums is not None:
+				accumulateMinimap(minimapsums, band, 1024 * tiley, texh / 1024)
+			yield tiley, band
+
+	chunks = [(tilex, tiley) for tiley in range(springmapy / 2) for tilex in range(springmapx / 2)]
+	usepool = myargs.numpydxt and myargs.jobs > 1
+	if usepool:
+		# without streaming the whole texture is shared and every chunk is queued at once, when streaming two bands are
+		# shared so the workers already encode the next band while the previous one is merged
+		sharedrows = 2048 if myargs.stream else texh
+		print 'Copying %i rows of the texture into shared memory for %i worker processes' % (sharedrows, myargs.jobs)
+		sharedshape = (sharedrows, texw, 4 if intex.mode == 'RGBA' else 3)
+		sharedtexture = multiprocessing.sharedctypes.RawArray('B', sharedshape[0] * sharedshape[1] * sharedshape[2])
+		sharedarray = np.frombuffer(sharedtexture, dtype=np.uint8).reshape(sharedshape)
+		if not myargs.stream:
+			for tiley, band in preparedBands():
+				sharedarray[1024 * tiley:1024 * (tiley + 1)] = band
+			band = None
+			bands = None
+			intex = None
+			gc.collect()
+		pool = multiprocessing.Pool(myargs.jobs, initChunkWorker, (sharedtexture, sharedshape))
+
+	def pipelinedBands():  # yields the chunk tables of each band, with the next band already submitted to the pool
+		pending = []
+		for tiley, band in preparedBands():
+			# the slot of this band was last used two bands ago, whose chunk tables have all been yielded already
+			sharedarray[1024 * (tiley % 2):1024 * (tiley % 2 + 1)] = band
+			pending.append(pool.imap(encodeSharedChunk, [(tilex, tiley % 2) for tilex in range(springmapx / 2)]))
+			if len(pending) == 2:
+				for chunktable in pending.pop(0):
+					yield chunktable
+		for chunktables in pending:
+			for chunktable in chunktables:
+				yield chunktable
 
+	smtfilename = myargs.outfile.replace('.smf', '.smt')
+	print 'Building tiles and writing tile file', smtfilename
+	tilefile = SMTWriter(smtfilename)  # yes, we are gonna use hashes of the tiles to perform rapid lossless compresssion :D
+	tileindices = np.empty((mapx / 4) * (mapy / 4), dtype=np.int32)
+	tileindices.fill(-1)
+	chunkx, chunky = np.divmod(np.arange(1024), 32)
+
+	def mergeChunk(tilex, tiley, localtiles, localindices):  # adds the unique tiles of a chunk to the tile file
+		# chunks are merged in row major order, so every mode gives the same tile order as a serial run
+		tileindex = tiley * (springmapx / 2) + tilex
+		globalindices = np.array([tilefile.addTile(tile.tobytes()) for tile in localtiles], dtype=np.int32)
+		tilepos = 32 * tilex + chunkx + (32 * springmapx / 2) * (32 * tiley + chunky)
+		if (tileindices[tilepos] != -1).any():
+			print 'something is very wrong here with tilepos, aborting compilation'
+			print tilex, tiley, tileindex
+			return False
+		tileindices[tilepos] = globalindices[localindices]
+		print tileindex,
+		return True
+
+	if usepool and not myargs.stream:
+		chunktables = pool.imap(encodeSharedChunk, chunks)
+	elif usepool:
+		chunktables = pipelinedBands()
+	elif myargs.numpydxt:  # chunks, their mip chains and dxt1 blocks only ever exist in memory
+		chunktables = (encodeChunk(band[:, 1024 * tilex:1024 * (tilex + 1)]) for tiley, band in preparedBands() for tilex
+					   in range(springmapx / 2))
+	else:
+		# make 1024x1024 tiles for nvdxt:
+		# todo: handle alpha in intex properly!
+		print 'Writing tiles',
+		extension = 'bmp'
+		if intex.mode == 'RGBA':
+			extension = 'tiff'
+		for tiley, band in preparedBands():
+			for tilex in range(springmapx / 2):
+				tileindex = tiley * (springmapx / 2) + tilex
+				print tileindex,
+				Image.fromarray(band[:, 1024 * tilex:1024 * (tilex + 1)]).save(
+					os.path.join('temp', 'temp%i.%s' % (tileindex, extension)))
+		chunktables = []  # the external compressors run once every chunk is written
+	for chunkindex, (localtiles, localindices) in enumerate(chunktables):
+		tilex, tiley = chunks[chunkindex]
+		if not mergeChunk(tilex, tiley, localtiles, localindices):
+			if usepool:
+				pool.terminate()
+			tilefile.close()
+			return
+	print ''
+	band = None
+	bands = None
+	chunktables = None
+	if usepool:
+		pool.close()
+		pool.join()
+		sharedarray = None
+		sharedtexture = None
 	intex = None
 	gc.collect()
 
-	print 'Building tiles'
-	tilehash = {}  # yes, we are gonna use the tiles as keys to perform rapid lossless compresssion :D
-	tileindices = {}
-
-	for tilex in range(springmapx / 2):
-		for tiley in range(springmapx / 2):
-			tileindex = tiley * (springmapx / 2) + tilex
-			ddsfile = open(os.path.join('temp', 'temp%i.dds' % (tileindex)), 'rb')
-			ddsdata = ddsfile.read()[128:]
-			for x in range(32):
-				for y in range(32):
-					tile = ReadTile(32 * x, 32 * y, ddsdata)
-					if len(tile) != SMALL_TILE_SIZE:
-						raise
-					if tile not in tilehash:
-						tilehash[tile] = len(tilehash)
-					tilepos = 32 * tilex + x + (32 * springmapx / 2) * (32 * tiley + y)
-					if tilepos in tileindices:
-						print 'something is very wrong here with tilepos, aborting compilation'
-						print x, y, tilex, tiley, tileindex
-						return
-					tileindices[tilepos] = tilehash[tile]
-			ddsfile.close()
-	# TODO: tilehash is larger than max tiles sometimes!
-	print 'Lossless compression of 32x32 tiles: %i tiles used of %i maximum' % (len(tilehash), 256 * springmapx * springmapy)
+	if not myargs.numpydxt:
+		print 'Converting to dds',
+		if myargs.linux:
+			basecmd = 'convert -format dds -define dds:mipmaps=3 -define dds:compression=dxt1 temp/temp%i.%s temp/temp%i.dds'
+			commands = [basecmd % (tiley * (springmapx / 2) + tilex, extension, tiley * (springmapx / 2) + tilex) for
+						tilex, tiley in chunks]
+		else:
+			compressionmethod = 'dxt1c'
+			if extension == 'tiff':
+				compressionmethod = 'dxt1a'
+			basecmd = 'nvdxt.exe -file temp\\temp%%i.%s -%s -outsamedir -nmips 4 %s' % (
+			extension, compressionmethod, myargs.nvdxt_options)
+			commands = [basecmd % (tiley * (springmapx / 2) + tilex) for tilex, tiley in chunks]
+		print 'with the base command of:', basecmd, 'running %i at a time' % (myargs.jobs)
+		if not runCommands(commands, myargs.jobs, myargs.timeout):
+			print 'Error: Failed to convert the texture chunks to dds, aborting compilation'
+			tilefile.close()
+			return
+		for tilex, tiley in chunks:
+			ddsdata = open(os.path.join('temp', 'temp%i.dds' % (tiley * (springmapx / 2) + tilex)), 'rb').read()[128:]
+			if not mergeChunk(tilex, tiley, *chunkTileTable(ddsdata)):
+				tilefile.close()
+				return
+		print ''
 
-	smtfilename = myargs.outfile.replace('.smf', '.smt')
-	print 'Writing tile file ',smtfilename
-	tilefile = open(smtfilename, 'wb')
-	tilefile.write(TileFileHeader_struct.pack('spring tilefile\0', 1, len(tilehash), 32, 1))
-	inversetiledict = {}
-	for tile, index in tilehash.iteritems():
-		inversetiledict[index] = tile
-	for i in range(len(inversetiledict)):
-		tilefile.write(inversetiledict[i])
 	tilefile.close()
+	print 'Lossless compression of 32x32 tiles: %i tiles used of %i maximum' % (tilefile.numtiles, 256 * springmapx * springmapy)
+	if tilefile.collisions > 0:
+		print 'Resolved %i tile hash collisions by comparing the tiles themselves' % (tilefile.collisions)
+	numtiles = tilefile.numtiles
+	if myargs.compress > 0 or (myargs.maxtiles > 0 and numtiles > myargs.maxtiles):
+		numtiles = compressTileFile(smtfilename, tileindices, myargs.compress * 32.0, myargs.maxtiles)
+
+	if minimapsums is not None:
+		area = (texw / 1024) * (texh / 1024)
+		mini = Image.fromarray(((minimapsums + area / 2) / area).astype(np.uint8))
+		minimapsums = None
+	if myargs.numpydxt:
+		print 'Creating minimap with the built-in NumPy DXT1 compressor'
+		mini = mini.convert('RGB')
+		if mini.size != (1024, 1024):
+			print 'Warning: minimap %s is not 1024x1024, resizing it' % (myargs.minimap)
+			mini = mini.resize((1024, 1024), Image.ANTIALIAS)
+		minimapdata = numpyEncodeDDS(np.asarray(mini), 9)
+	else:
+		minimapfilename = os.path.join('temp', 'mini.png')
+		print 'Creating minimap', minimapfilename, 'using the command:',
+		if myargs.minimap:
+			minimapfilename = myargs.minimap
+		else:
+			mini.save(minimapfilename)
+		if myargs.linux:
+			cmd = 'convert -format dds -define dds:mipmaps=8 -define dds:compression=dxt1 %s temp/mini.dds' % (
+			minimapfilename)
+		else:
+			cmd = 'nvdxt.exe -file %s -dxt1c -nmips 9 -output temp/mini.dds -Sinc -quality_highest' % (minimapfilename)
+		print cmd
+		if not runCommands([cmd], 1, myargs.timeout):
+			print 'Error: Failed to convert the minimap to dds, aborting compilation'
+			return
+		minimapdata = open(os.path.join('temp', 'mini.dds'), 'rb').read()[128:]
+	mini = None
 
 	smffile = open(myargs.outfile, 'wb')
 	# smffile.write(SMFHeader_struct.pack())
@@ -571,39 +1575,31 @@ def compileSMF(myargs):
 
 	tilesptr = metalmapptr + mapx * mapy / 4
 	numtilefiles = 1
-	numtiles = len(tilehash)
 
 	# numtilefiles,numtiles, numtiles, smtfilename,\0,
 	featureptr = tilesptr + 4 + 4 + 4 + len(smtfilename) + 1 + 4 * (mapx * mapy / 16)
 	numfeaturetype = len(featuretypes)
-	numfeatures = len(featureplacement)
+	numfeatures = len(features)
 	smffile.write(SMFHeader_struct.pack(magic, version, mapid, mapx, mapy, squaresize, texelspersquare, tilesize,
 										myargs.minheight, myargs.maxheight, heightmapptr, typemapptr, tilesptr,
 										minimapptr, metalmapptr, featureptr, numExtraHeaders))
 	smffile.write(ExtraHeader_struct.pack(12, 1, vegmapPtr))
-	print 'Size of vegetation (grass) map in pixels = ', len(vegmap)
-	for v in vegmap:
-		smffile.write(struct.pack('B', v))
-	for h in heights:
-		smffile.write(struct.pack('<H', h))
-	for t in typemap:
-		smffile.write(struct.pack('B', t))
+	print 'Size of vegetation (grass) map in pixels = ', vegmap.size
+	writeArray(smffile, vegmap, np.uint8)
+	writeArray(smffile, heights, '<u2')
+	writeArray(smffile, typemap, np.uint8)
 	smffile.write(minimapdata)
 	if verbose:
 		print 'Length of minimap data chunk = ', len(minimapdata), ', should be equal to', MINIMAP_SIZE
-		print 'Length of metalmap data chunk', len(metalmap)
-	for m in metalmap:
-		smffile.write(struct.pack('B', m))
+		print 'Length of metalmap data chunk', metalmap.size
+	writeArray(smffile, metalmap, np.uint8)
 	smffile.write(MapTileHeader_struct.pack(numtilefiles, numtiles))
 	smffile.write(struct.pack('< i %is' % (len(smtfilename + '\0')), numtiles, smtfilename + '\0'))
-	for i in range(mapx * mapy / 16):
-		smffile.write(struct.pack('< i', tileindices[i]))
+	writeArray(smffile, tileindices, '<i4')
 	smffile.write(MapFeatureHeader_struct.pack(numfeaturetype, numfeatures))
 	for fname in featuretypes:
 		smffile.write(struct.pack('%is' % (len(fname + '\0')), fname + '\0'))
-	for f in featureplacement:
-		smffile.write(
-			MapFeatureStruct_struct.pack(featuretypes.index(f['name']), f['x'], f['y'], f['z'], f['rot'], f['scale']))
+	writeArray(smffile, features, MapFeatureStruct_dtype)
 	smffile.close()
 
 	print 'Cleaning up temp dir...'
@@ -616,12 +1612,13 @@ def compileSMF(myargs):
 	print 'All Done! You may now close the main window to exit the program :)'
 
 
-class SMFMapDecompiler:
-	def __init__(self, filename):
-		verbose = True
+class SMFMapReader(object):  # reads the sections of an .smf and its .smt files lazily, each one is parsed on first access
+	def __init__(self, filename, verbose=True):
+		self.verbose = verbose
 		self.filename = filename
 		self.basename = filename.rpartition('.')[0]
-		self.smffile = open(filename, 'rb').read()
+		# the files are memory mapped and every section is a view into the mapping, so only the pages used are ever read
+		self.smffile = mapFile(filename)
 		self.SMFHeader = SMFHeader_struct.unpack_from(self.smffile, 0)
 
 		self.magic = self.SMFHeader[0]  # ;      ///< "spring map file\0"
@@ -647,57 +1644,224 @@ class SMFMapDecompiler:
 
 		self.numExtraHeaders = self.SMFHeader[16]  # ; ///< Numbers of extra headers following main header'''
 		if verbose:
-			attrs = vars(self)
 			print self.SMFHeader
 
+	@lazyproperty
+	def heightmap(self):
+		return np.frombuffer(self.smffile, dtype='<u2', count=(1 + self.mapx) * (1 + self.mapy),
+							 offset=self.heightmapPtr).reshape(1 + self.mapy, 1 + self.mapx)
+
+	@lazyproperty
+	def metalmap(self):
+		return np.frombuffer(self.smffile, dtype=np.uint8, count=(self.mapx / 2) * (self.mapy / 2),
+							 offset=self.metalmapPtr).reshape(self.mapy / 2, self.mapx / 2)
+
+	@lazyproperty
+	def typemap(self):
+		return np.frombuffer(self.smffile, dtype=np.uint8, count=(self.mapx / 2) * (self.mapy / 2),
+							 offset=self.typeMapPtr).reshape(self.mapy / 2, self.mapx / 2)
+
+	@lazyproperty
+	def minimap(self):  # the raw dxt1 data of the minimap and its mipmaps
+		return self.smffile[self.minimapPtr:self.minimapPtr + MINIMAP_SIZE]
+
+	@lazyproperty
+	def extraheaders(self):  # list of (size, type, extraoffset)
+		extraheaders = []
+		for extraheader_index in range(self.numExtraHeaders):
+			extraheader = ExtraHeader_struct.unpack_from(self.smffile,
+														 extraheader_index * ExtraHeader_struct.size + SMFHeader_struct.size)
+			if self.verbose:
+				print 'Extraheader:', extraheader, '(size, type, extraoffset)'
+			extraheaders.append(extraheader)
+		return extraheaders
+
+	@lazyproperty
+	def grassmap(self):  # None if the map has no grass extra header
+		grassmap = None
+		for extraheader_size, extraheader_type, extraoffset in self.extraheaders:
+			if extraheader_type == 1:  # grass
+				grassmap = np.frombuffer(self.smffile, dtype=np.uint8, count=(self.mapx / 4) * (self.mapy / 4),
+										 offset=extraoffset).reshape(self.mapy / 4, self.mapx / 4)
+		return grassmap
+
+	@lazyproperty
+	def featurenames(self):
+		# MapFeatureHeader is followed by numFeatureType zero terminated strings indicating the names
+		# of the features in the map. Then follow numFeatures MapFeatureStructs.
+		self.numFeatureType, self.numFeatures = MapFeatureHeader_struct.unpack_from(self.smffile, self.featurePtr)
+		if self.verbose:
+			print 'MapFeatureHeader=', (self.numFeatureType, self.numFeatures), '(numFeatureType, numFeatures)'
+		featurenames = []
+		featureoffset = self.featurePtr + MapFeatureHeader_struct.size
+		while len(featurenames) < self.numFeatureType:
+			featurename = unpack_null_terminated_string(self.smffile, featureoffset)
+			featurenames.append(featurename)
+			featureoffset += len(featurename) + 1  # cause of null terminator
+		self.featuresPtr = featureoffset
+		return featurenames
+
+	@lazyproperty
+	def features(self):  # a MapFeatureStruct_dtype view of the feature placements
+		featurenames = self.featurenames  # also finds where the features start
+		return np.frombuffer(self.smffile, dtype=MapFeatureStruct_dtype, count=self.numFeatures,
+							 offset=self.featuresPtr)
+
+	@lazyproperty
+	def tilefiles(self):  # list of [tilefilename, numtilesinfile]
+		self.numtilefiles, self.numtiles = MapTileHeader_struct.unpack_from(self.smffile, self.tilesPtr)
+		if self.verbose:
+			print 'MapTileHeader=', (self.numtilefiles, self.numtiles), '(numTileFiles, numTiles)'
+		tilefiles = []
+		tileoffset = self.tilesPtr + MapTileHeader_struct.size
+		for i in range(self.numtilefiles):
+			numtilesinfile = struct.unpack_from('< i', self.smffile, tileoffset)[0]
+			tileoffset += 4  # sizeof(int)
+			tilefilename = unpack_null_terminated_string(self.smffile, tileoffset)
+			tileoffset += len(tilefilename) + 1  # cause of null terminator
+			tilefiles.append([tilefilename, numtilesinfile])
+		self.tileindicesPtr = tileoffset
+		return tilefiles
+
+	@lazyproperty
+	def tileindices(self):
+		tilefiles = self.tilefiles  # also finds where the tile indices start
+		return np.frombuffer(self.smffile, dtype='<i4', count=(self.mapx / 4) * (self.mapy / 4),
+							 offset=self.tileindicesPtr).reshape(self.mapy / 4, self.mapx / 4)
+
+	@lazyproperty
+	def tiles(self):  # an (numTiles, SMALL_TILE_SIZE) view of the tiles in each tile file
+		tiles = []
+		for tilefilename, numtilesinfile in self.tilefiles:
+			tilefile = mapFile(tilefilename)
+			tileFileHeader = TileFileHeader_struct.unpack_from(tilefile, 0)
+			magic, version, numTiles, tileSize, compressionType = tileFileHeader
+			if self.verbose:
+				print tilefilename, 'has', numTiles, 'tiles'
+			tiles.append(np.frombuffer(tilefile, dtype=np.uint8, count=numTiles * SMALL_TILE_SIZE,
+									   offset=TileFileHeader_struct.size).reshape(numTiles, SMALL_TILE_SIZE))
+		return tiles
+
+	def gatherTiles(self, indices):  # the raw tiles with the given indices, which count on from one tile file to the next
+		gathered = np.empty((len(indices), SMALL_TILE_SIZE), dtype=np.uint8)
+		start = 0
+		for tiles in self.tiles:
+			inside = (indices >= start) & (indices < start + len(tiles))
+			gathered[inside] = tiles[indices[inside] - start]  # only the pages of these tiles are read from the mapping
+			start += len(tiles)
+		return gathered
+
+	def textureBands(self, region=None, level=0, cachesize=256 * 1024 * 1024):
+		# yields the (left, top, width, height) rectangle of the texture, in pixels which are also elmos, or all of it,
+		# as bands of one row of tiles, cropped to the rectangle. Only the tiles covering the rectangle are decoded,
+		# levels 1-3 decode just the 16x16, 8x8 or 4x4 mip of each tile, for a 1/2, 1/4 or 1/8 size texture.
+		# Decoded tiles are kept in a cache of at most cachesize bytes (but at least one row of tiles),
+		# which is emptied when it is full, so each unique tile is usually decoded only once.
+		left, top, width, height = region if region is not None else (0, 0, self.mapx * 8, self.mapy * 8)
+		size = 32 >> level
+		scale = 1 << level  # the crop is rounded outwards to whole pixels of the level
+		tileleft, tiletop = left / 32, top / 32
+		tileright, tilebottom = (left + width + 31) / 32, (top + height + 31) / 32
+		tileindices = self.tileindices[tiletop:tilebottom, tileleft:tileright]
+		uniquetiles, tileindices = np.unique(tileindices, return_inverse=True)
+		tileindices = tileindices.reshape(tilebottom - tiletop, tileright - tileleft)
+		print 'Decoding %i unique tiles' % (len(uniquetiles))
+		capacity = min(len(uniquetiles), max(tileright - tileleft, cachesize / (size * size * 3)))
+		cache = np.empty((capacity, size, size, 3), dtype=np.uint8)
+		slots = np.full(len(uniquetiles), -1, dtype=np.int64)  # where each unique tile is in the cache
+		cached = 0
+		croptop, cropbottom = (top - tiletop * 32) / scale, (top - tiletop * 32 + height + scale - 1) / scale
+		cropleft, cropright = (left - tileleft * 32) / scale, (left - tileleft * 32 + width + scale - 1) / scale
+		for ty in range(tilebottom - tiletop):
+			needed = np.unique(tileindices[ty])
+			missing = needed[slots[needed] < 0]
+			if cached + len(missing) > capacity:
+				slots[:] = -1
+				cached = 0
+				missing = needed
+			slots[missing] = np.arange(cached, cached + len(missing))
+			cache[cached:cached + len(missing)] = numpyDecodeTiles(self.gatherTiles(uniquetiles[missing]), level)
+			cached += len(missing)
+			band = cache[slots[tileindices[ty]]].swapaxes(0, 1).reshape(size, -1, 3)
+			yield band[max(croptop - ty * size, 0):cropbottom - ty * size, cropleft:cropright]
+
+	def textureSize(self, region=None, level=0):  # the (width, height) of what textureBands yields
+		left, top, width, height = region if region is not None else (0, 0, self.mapx * 8, self.mapy * 8)
+		scale = 1 << level
+		return (((left % 32) + width + scale - 1) / scale - (left % 32) / scale,
+				((top % 32) + height + scale - 1) / scale - (top % 32) / scale)
+
+	def decodeTexture(self, region=None, level=0):  # decodes the same rectangle as textureBands into one array
+		width, height = self.textureSize(region, level)
+		texture = np.empty((height, width, 3), dtype=np.uint8)
+		row = 0
+		for band in self.textureBands(region, level):
+			texture[row:row + band.shape[0]] = band
+			row += band.shape[0]
+		return texture
+
+
+class SMFMapDecompiler(SMFMapReader):  # writes the selected sections of a map as files it can be recompiled from
+	outputs = ['height', 'metal', 'type', 'minimap', 'grass', 'features', 'texture', 'settings']
+
+	def __init__(self, filename, only=None, region=None, previewlevel=0, stream=False):
+		SMFMapReader.__init__(self, filename)
+		self.previewlevel = previewlevel
+		self.stream = stream
+		self.region = None
+		if region is not None:
+			try:
+				left, top, width, height = [int(value) for value in region.split(',')]
+			except ValueError:
+				print 'Error: the region must be given as x,y,width,height, got', region
+				return
+			right, bottom = min(left + width, self.mapx * 8), min(top + height, self.mapy * 8)
+			left, top = max(left, 0), max(top, 0)
+			if right <= left or bottom <= top:
+				print 'Error: the region %s is outside of the %i by %i texture' % (region, self.mapx * 8, self.mapy * 8)
+				return
+			self.region = (left, top, right - left, bottom - top)
+		selected = self.outputs if only is None else [output.strip() for output in only.split(',') if output.strip()]
+		for output in selected:
+			if output not in self.outputs:
+				print 'Error: unknown decompile output %s, choose from %s' % (output, ','.join(self.outputs))
+				return
+		for output in self.outputs:  # always in file order, however they were listed
+			if output in selected:
+				getattr(self, 'write' + output.capitalize())()
+
+		print 'Done, one final bit of important info: the maps maxheight is %i, while the minheight is %i' % (
+		self.maxHeight, self.minHeight)
+
+	def writeHeight(self):
 		print 'Writing heightmap RAW (Remember, this is a %i by %i 16bit 1 channel IBM byte order raw!)' % (
 		(1 + self.mapx), (1 + self.mapy))
-		self.heightmap = struct.unpack_from('< %iH' % ((1 + self.mapx) * (1 + self.mapy)), self.smffile,
-											self.heightmapPtr)
 		heightmap_file = open(self.basename + '_height.raw', 'wb')
-		for pixel in self.heightmap:
-			heightmap_file.write(struct.pack('< H', pixel))
+		writeArray(heightmap_file, self.heightmap, '<u2')
 		heightmap_file.close()
 
 		print 'Writing heightmap BMP'
-		heightmap_img = Image.new('RGB', (1 + self.mapx, 1 + self.mapy), 'black')
-		heightmap_img_pixels = heightmap_img.load()
-		for x in range(heightmap_img.size[0]):
-			for y in range(heightmap_img.size[1]):
-				height = self.heightmap[(heightmap_img.size[0]) * y + x] / 256
-				heightmap_img_pixels[x, y] = (height, height, height)
-		heightmap_img.save(self.basename + '_height.bmp')
+		Image.fromarray((self.heightmap / 256).astype(np.uint8)).convert('RGB').save(self.basename + '_height.bmp')
 
 		print 'Writing heightmap PNG'
 		heightmap_png_file = open(self.basename + '_height.png', 'wb')
 		heightmap_png_writer = png.Writer(width=1 + self.mapx, height=1 + self.mapy, greyscale=True, bitdepth=16)
-		heightmap_per_rows = []
-		for y in range(self.mapy + 1):
-			heightmap_per_rows.append(self.heightmap[(self.mapx + 1) * y: (self.mapx + 1) * (y + 1)])
-		heightmap_png_writer.write(heightmap_png_file, heightmap_per_rows)
+		heightmap_png_writer.write(heightmap_png_file, self.heightmap)
 		heightmap_png_file.close()
 
+	def writeMetal(self):
 		print 'Writing MetalMap'
-		self.metalmap = struct.unpack_from('< %iB' % ((self.mapx / 2) * (self.mapy / 2)), self.smffile,
-										   self.metalmapPtr)
-		metalmap_img = Image.new('RGB', (self.mapx / 2, self.mapy / 2), 'black')
-		metalmap_img_pixels = metalmap_img.load()
-		for x in range(metalmap_img.size[0]):
-			for y in range(metalmap_img.size[1]):
-				metal = self.metalmap[(metalmap_img.size[0]) * y + x]
-				metalmap_img_pixels[x, y] = (metal, 0, 0)
-		metalmap_img.save(self.basename + '_metal.bmp')
+		metalmap_img = np.zeros((self.mapy / 2, self.mapx / 2, 3), dtype=np.uint8)
+		metalmap_img[:, :, 0] = self.metalmap
+		Image.fromarray(metalmap_img).save(self.basename + '_metal.bmp')
 
+	def writeType(self):
 		print 'Writing typemap'
-		self.typemap = struct.unpack_from('< %iB' % ((self.mapx / 2) * (self.mapy / 2)), self.smffile, self.typeMapPtr)
-		typemap_img = Image.new('RGB', (self.mapx / 2, self.mapy / 2), 'black')
-		typemap_img_pixels = typemap_img.load()
-		for x in range(typemap_img.size[0]):
-			for y in range(typemap_img.size[1]):
-				typep = self.typemap[(typemap_img.size[0]) * y + x]
-				typemap_img_pixels[x, y] = (typep, 0, 0)
-		typemap_img.save(self.basename + '_type.bmp')
+		typemap_img = np.zeros((self.mapy / 2, self.mapx / 2, 3), dtype=np.uint8)
+		typemap_img[:, :, 0] = self.typemap
+		Image.fromarray(typemap_img).save(self.basename + '_type.bmp')
 
+	def writeMinimap(self):
 		print 'Writing minimap'
 		miniddsheaderstr = ([68, 68, 83, 32, 124, 0, 0, 0, 7, 16, 10, 0, 0, 4, 0, 0, 0, 4, 0, 0, 0, 0, 8, 0, 0, 0, 0, 0,
 							 11, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
@@ -705,130 +1869,45 @@ class SMFMapDecompiler:
 							 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 32, 0, 0, 0, 4, 0, 0, 0, 68, 88, 84, 49, 0, 0, 0, 0, 0, 0,
 							 0, 0, 0, 0, 0, 0, 0,
 							 0, 0, 0, 0, 0, 0, 0, 8, 16, 64, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-		self.minimap = self.smffile[self.minimapPtr:self.minimapPtr + MINIMAP_SIZE]
 		minimap_file = open(self.basename + '_mini.dds', 'wb')
 		for c in miniddsheaderstr:
 			minimap_file.write(struct.pack('< B', c))
 		minimap_file.write(self.minimap)
 		minimap_file.close()
 
+	def writeGrass(self):
 		print 'Writing grassmap'
-		# vegmapoffset = SMFHeader_struct.size+ExtraHeader_struct.size+4
-		for extraheader_index in range(self.numExtraHeaders):
-			extraheader = ExtraHeader_struct.unpack_from(self.smffile,
-														 extraheader_index * ExtraHeader_struct.size + SMFHeader_struct.size)
-			if verbose:
-				print 'Extraheader:', extraheader, '(size, type, extraoffset)'
-			extraheader_size, extraheader_type, extraoffset = extraheader
-			# print 'ExtraHeader',extraheader
-			if extraheader_type == 1:  # grass
-				# self.grassmap=struct.unpack_from('< %iB'%((self.mapx/4)*(self.mapy/4)),self.smffile,ExtraHeader_struct.size+SMFHeader_struct.size+extraheader_size)
-				self.grassmap = struct.unpack_from('< %iB' % ((self.mapx / 4) * (self.mapy / 4)), self.smffile,
-												   extraoffset)
-				grassmap_img = Image.new('RGB', (self.mapx / 4, self.mapy / 4), 'black')
-				grassmap_img_pixels = grassmap_img.load()
-				for x in range(grassmap_img.size[0]):
-					for y in range(grassmap_img.size[1]):
-						grass = self.grassmap[(grassmap_img.size[0]) * y + x]
-						if grass == 1:
-							grass = 255
-						else:
-							grass = 0
-						grassmap_img_pixels[x, y] = (grass, grass, grass)
-				grassmap_img.save(self.basename + '_grass.bmp')
+		if self.grassmap is not None:
+			Image.fromarray(np.where(self.grassmap == 1, 255, 0).astype(np.uint8)).convert('RGB').save(
+				self.basename + '_grass.bmp')
 
-		# MapFeatureHeader is followed by numFeatureType zero terminated strings indicating the names
-		# of the features in the map. Then follow numFeatures MapFeatureStructs.
-		self.mapfeaturesheader = MapFeatureHeader_struct.unpack_from(self.smffile, self.featurePtr)
-		if verbose:
-			print 'MapFeatureHeader=', self.mapfeaturesheader, '(numFeatureType, numFeatures)'
-			print 'MapTileHeader=', MapTileHeader_struct.unpack_from(self.smffile, self.tilesPtr), '(numTileFiles, numTiles)'
-			self.somelulz = self.smffile[self.tilesPtr - 10:self.tilesPtr + 30]
-		self.numFeatureType, self.numFeatures = self.mapfeaturesheader
-		self.featurenames = []
-		featureoffset = self.featurePtr + MapFeatureHeader_struct.size
-		while len(self.featurenames) < self.numFeatureType:
-			featurename = unpack_null_terminated_string(self.smffile, featureoffset)
-			self.featurenames.append(featurename)
-			featureoffset += len(featurename) + 1  # cause of null terminator
-			print featurename
-			'''nextchar= 'N'
-			while nextchar != '\0':
-				nextchar=struct.unpack_from('c',self.smffile,len(featurename)+self.featurePtr+MapFeatureHeader_struct.size
-					+sum([len(fname)+1 for fname in self.featurenames]))[0]
-				if nextchar =='\0':
-					self.featurenames.append(featurename)
-					featurename=''
-				else:
-					featurename+=nextchar'''
-
-		print 'Features found in map definition', self.featurenames
-		feature_offset = self.featurePtr + MapFeatureHeader_struct.size + sum(
-			[len(fname) + 1 for fname in self.featurenames])
-		self.features = []
-		for feature_index in range(self.numFeatures):
-			feat = MapFeatureStruct_struct.unpack_from(self.smffile,
-													   feature_offset + MapFeatureStruct_struct.size * feature_index)
-			# print feat
-			self.features.append(
-				{'name': self.featurenames[feat[0]], 'x': feat[1], 'y': feat[2], 'z': feat[3], 'rotation': feat[4],
-				 'relativeSize': feat[5], })
-		# print self.features[-1]
+	def writeFeatures(self):
+		featurenames = self.featurenames
+		print 'Features found in map definition', featurenames
 		print 'Writing feature placement file'
 		feature_file = open(self.basename + '_featureplacement.lua', 'w')
-		for feature in self.features:
+		for featuretype, x, z, rotation, scale in zip(self.features['type'].tolist(), self.features['x'].tolist(),
+													  self.features['z'].tolist(), self.features['rot'].tolist(),
+													  self.features['scale'].tolist()):
 			feature_file.write('{ name = \'%s\', x = %i, z = %i, rot = "%i" ,scale = %f },\n' % (
-			feature['name'], feature['x'], feature['z'], feature['rotation'], feature['relativeSize']))
+			featurenames[featuretype], x, z, rotation, scale))
 		feature_file.close()
 
-		print 'loading tile files'
-		self.maptileheader = MapTileHeader_struct.unpack_from(self.smffile, self.tilesPtr)
-		self.numtilefiles, self.numtiles = self.maptileheader
-		self.tilefiles = []
-		tileoffset = self.tilesPtr + MapTileHeader_struct.size
-		for i in range(self.numtilefiles):
-			numtilesinfile = struct.unpack_from('< i', self.smffile, tileoffset)[0]
-			tileoffset += 4  # sizeof(int)
-			tilefilename = unpack_null_terminated_string(self.smffile, tileoffset)
-			tileoffset += len(tilefilename) + 1  # cause of null terminator
-			self.tilefiles.append(
-				#[tilefilename, numtilesinfile, open(filename.rpartition('\\')[0] + '\\' + tilefilename, 'rb').read()])
-				[tilefilename, numtilesinfile, open(tilefilename, 'rb').read()])
-			print tilefilename, 'has', numtilesinfile, 'tiles'
-		self.tileindices = struct.unpack_from('< %ii' % ((self.mapx / 4) * (self.mapy / 4)), self.smffile, tileoffset)
-
-		self.tiles = []
-		for tilefile in self.tilefiles:
-			tileFileHeader = TileFileHeader_struct.unpack_from(tilefile[2], 0)
-			magic, version, numTiles, tileSize, compressionType = tileFileHeader
-			# print tilefile[0],': magic,version,numTiles,tileSize,compressionType',magic,version,numTiles,tileSize,compressionType
-			for i in range(numTiles):
-				self.tiles.append(struct.unpack_from('< %is' % (SMALL_TILE_SIZE), tilefile[2],
-													 TileFileHeader_struct.size + i * SMALL_TILE_SIZE)[0])
-
-		print 'Generating texture, this is very very slow (few minutes)'
-		textureimage = Image.new('RGB', (self.mapx * 8, self.mapy * 8), 'black')
-		textureimagepixels = textureimage.load()
-		for ty in range(self.mapy / 4):
-			# print 'row',ty
-			for tx in range(self.mapx / 4):
-				currtile = self.tiles[self.tileindices[(self.mapx / 4) * ty + tx]]
-				# print 'Tile',(self.mapx/4)*ty+tx
-				# one tile is 32x32, and pythonDecodeDXT1 will need one 'row' of data, assume this is 8*8 bytes
-				for rows in xrange(8):
-					# print "currtile",currtile
-					dxdata = currtile[rows * 64:(rows + 1) * 64]
-					# print len(dxdata),dxdata
-					dxtrows = pythonDecodeDXT1(dxdata)  # decode in 8 block chunks
-					for x in xrange(tx * 32, (tx + 1) * 32):
-						for y in xrange(ty * 32 + 4 * rows, ty * 32 + 4 + 4 * rows):
-							# print rows, tx,ty,x,y
-							# print dxtrows
-							oy = (ty * 32 + 4 * rows)
-							textureimagepixels[x, y] = (
-							ord(dxtrows[y - oy][3 * (x - tx * 32) + 0]), ord(dxtrows[y - oy][3 * (x - tx * 32) + 1]),
-							ord(dxtrows[y - oy][3 * (x - tx * 32) + 2]))
-		textureimage.save(self.basename + '_texture.bmp')
+	def writeTexture(self):
+		print 'Generating texture'
+		texturefilename = self.basename + '_texture.bmp'
+		if self.region is not None:
+			texturefilename = self.basename + '_texture_%i_%i_%i_%i.bmp' % self.region
+		if self.previewlevel > 0:
+			texturefilename = texturefilename.replace('.bmp', '_preview%i.bmp' % self.previewlevel)
+		if self.stream:  # one row of tiles is written at a time, so the texture is never whole in memory
+			width, height = self.textureSize(self.region, self.previewlevel)
+			streamBMP(texturefilename, width, height, self.textureBands(self.region, self.previewlevel))
+		else:
+			textureimage = Image.fromarray(self.decodeTexture(self.region, self.previewlevel), 'RGB')
+			textureimage.save(texturefilename)
+
+	def writeSettings(self):
 		infofile = open(self.basename + '_compilation_settings.txt', 'w')
 
 		infofile.write('-%s\n%s\n' % ('n', str(self.minHeight)))
@@ -844,11 +1923,9 @@ class SMFMapDecompiler:
 
 		infofile.close()
 
-		print 'Done, one final bit of important info: the maps maxheight is %i, while the minheight is %i' % (
-		self.maxHeight, self.minHeight)
-
 
 if __name__ == "__main__":
+	multiprocessing.freeze_support()
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-x', '--maxheight',
 						help=' <max height> (required) What altitude in spring the max(0xff for 8 bit images or 0xffff for 16bit images) level of the height map represents',
@@ -866,8 +1943,11 @@ if __name__ == "__main__":
 						help='<texturemap.bmp> (required) Input bitmap to use for the map. Sides must be multiple of 1024 long. Xsize and Ysize are determined from this file; xsize = intex width / 8, ysize = height / 8',
 						default='', type=str)
 	parser.add_argument('-a', '--heightmap',
-						help='<heightmap file> (required) Input heightmap to use for the map, this should be 16 bit greyscale PNG image or a 16bit intel byte order single channel .raw image. Must be xsize*64+1 by ysize*64+1',
+						help='<heightmap file> (required) Input heightmap to use for the map, this should be 16 bit greyscale PNG or TIFF image or a 16bit intel byte order single channel .raw image. Float32 .raw/.tif and float .npy heightmaps in elmos are also accepted. Must be xsize*64+1 by ysize*64+1',
 						default='', type=str)
+	parser.add_argument('--autorange',
+						help='Fit minheight and maxheight to the lowest and highest point of the heightmap and use the full 16 bit range between them. Needed for float heightmaps unless min/maxheight are given in elmos',
+						default=False, action='store_true')
 
 	parser.add_argument('-g', '--geoventfile',
 						help='<geovent.bmp> The decal for geothermal vents; appears on the compiled map at each vent. Custom geovent decals should use all white as transparent, clear this if you do not wish to have geovents drawn.',
@@ -875,15 +1955,40 @@ if __name__ == "__main__":
 	parser.add_argument('-y', '--typemap',
 						help='<typemap.bmp> Type map to use, uses the red channel to decide terrain type. types are defined in the .smd, if this argument is skipped the entire map will TERRAINTYPE0',
 						type=str)
-	# parser.add_argument('-c', '--compress', help =  '<compression> How much we should try to compress the texture map. Values between [0;1] lower values make higher quality, larger files. [NOT IMPLEMENTED YET]',  default = 0.0, type = float )
-
-	# parser.add_argument('-i', '--invert', help = 'Flip the height map image upside-down on reading.', default = False, action='store_true' )
-	# parser.add_argument('-l', '--lowpass', help = '<int kernelsize> Smoothes the heightmap with a gaussian kernel size specified', default = 0, type=int)
+	parser.add_argument('-c', '--compress',
+						help='<compression> How much we should try to compress the texture map. Values between [0;1] lower values make higher quality, larger files. Tiles whose decoded RMS difference is below compression * 32 are merged (lossy)',
+						default=0.0, type=float)
+	parser.add_argument('--maxtiles',
+						help='<N> Tile budget, if the map has more unique tiles than this, similar tiles are merged (lossy) until it fits',
+						default=0, type=int)
+
+	parser.add_argument('-i', '--invert', help='Flip the height map image upside-down on reading.', default=False,
+						action='store_true')
+	parser.add_argument('-l', '--lowpass', help='<int kernelsize> Smoothes the heightmap with a gaussian kernel size specified',
+						default=0, type=int)
+	parser.add_argument('--deterrace',
+						help='<int kernelsize> Smoothes the steps out of 8 bit or otherwise terraced heightmaps with a gaussian kernel size specified, while keeping every height within half a step of the original',
+						default=0, type=int)
 
 
 	parser.add_argument('-k', '--featureplacement',
-						help='<featureplacement.lua> A feature placement text file defining the placement of each feature. (Default: fp.txt). See README.txt for details. The default format specifies it to have each line look like this: \n { name = \'agorm_talltree6\', x = 224, z = 3616, rot = "0" , scale = 1.0} \n the [scale] argument currently does nothing in the engine. ',
+						help='<featureplacement.lua> A feature placement text file defining the placement of each feature. (Default: fp.txt). See README.txt for details. The default format specifies it to have each line look like this: \n { name = \'agorm_talltree6\', x = 224, z = 3616, rot = "0" , scale = 1.0} \n the [scale] argument currently does nothing in the engine. Machine generated placements can also be given as a .csv file with a header line naming its name, x, z and optional y, rot and scale columns, or as a .npy structured array with fields of those names. ',
 						type=str)
+	parser.add_argument('--scatterlist',
+						help='<scatterlist.txt> A file with a line of \'featurename densitymap.bmp spacing [rotation]\' for each feature type to scatter over the map. Features are placed at least spacing elmos apart, with the brightness of the greyscale density map (stretched over the whole map) as the chance of a feature at each spot. The rotation defaults to -1, which rotates each feature randomly. Uses --seed.',
+						type=str)
+	parser.add_argument('--featuremerge',
+						help='<radius> Merge features of the same type closer than this many elmos into the first of them, to remove stacked duplicates',
+						default=0.0, type=float)
+	parser.add_argument('--featurecap',
+						help='<N> Keep at most this many features in each feature density cell, the first ones placed are kept',
+						default=0, type=int)
+	parser.add_argument('--featurecell',
+						help='<elmos> Size of the cells used for the feature density statistics and --featurecap',
+						default=128, type=int)
+	parser.add_argument('--groundheight',
+						help='Set the y coordinate of every feature to the height of the ground under it, sampled bilinearly from the heightmap',
+						default=False, action='store_true')
 	parser.add_argument('-j', '--featurelist',
 						help='<feature_list_file.txt> (required if featuremap image is specified) A file with the name of one feature on each line. Specifying a number from 32767 to -32768 next to the feature name will tell mapconv how much to rotate the feature. specifying -1 will rotate it randomly.',
 						type=str)
@@ -893,6 +1998,9 @@ if __name__ == "__main__":
 	parser.add_argument('-p', '--minimap',
 						help=' <minimap.bmp> If specified, will override generating a minimap from the texture file (intex) with the specified file. Must be 1024x1024 size.',
 						type=str)
+	parser.add_argument('--seed',
+						help='<N> Seed for the random grass placement from the featuremap and the map id, so that builds are reproducible',
+						default=None, type=int)
 	parser.add_argument('-r', '--grassmap',
 						help=' <grassmap.bmp> If specified, will override the grass specified in the featuremap. Expects an xsize/4 x ysize/4 sized bitmap, all values that are not 0 will result in grass',
 						type=str)
@@ -901,9 +2009,30 @@ if __name__ == "__main__":
 	parser.add_argument('-u', '--linux',
 						help='Check this if you are running linux and wish to use imagemagicks convert utility instead of nvdxt.exe',
 						default=False, action='store_true')
+	parser.add_argument('--numpydxt',
+						help='Use the built-in NumPy DXT1 compressor instead of nvdxt.exe or imagemagicks convert utility, this needs no external tools',
+						default=False, action='store_true')
+	parser.add_argument('--stream',
+						help='Read the texture in bands of 1024 rows instead of loading it whole, so memory use stays around one band. Only uncompressed .bmp textures can be streamed, the minimap is then box filtered from the bands. When decompiling, the texture is decoded and written as a top down .bmp one row of tiles at a time',
+						default=False, action='store_true')
+	parser.add_argument('--jobs',
+						help='<N> Number of texture chunks compressed in parallel, as worker processes with --numpydxt or as concurrent nvdxt.exe/convert runs otherwise',
+						default=1, type=int)
+	parser.add_argument('--timeout',
+						help='<seconds> Time limit for each nvdxt.exe or convert run, after which it is killed and compilation is aborted',
+						default=600, type=int)
 	parser.add_argument('-v', '--nvdxt_options', help='NVDXT compression options ', default='-Sinc -quality_highest')
 	parser.add_argument('-q', '--quick', help='Quick compilation (lower texture quality)', action='store_true')
 	parser.add_argument('-d', '--decompile', help='Decompiles a map to everything you need to recompile it', type=str)
+	parser.add_argument('--only',
+						help='<outputs> Comma separated list of what to decompile, from height,metal,type,minimap,grass,features,texture,settings (default: all of them). Only the sections needed are read, so e.g. --only height skips decoding the texture',
+						default=None, type=str)
+	parser.add_argument('--region',
+						help='<x,y,width,height> Only decompile this rectangle of the texture, given in texture pixels which are the same as elmos. Just the tiles under it are decoded, the crop is saved as _texture_x_y_width_height.bmp',
+						default=None, type=str)
+	parser.add_argument('--preview-level',
+						help='<1|2|3> Decompile a 1/2, 1/4 or 1/8 size preview of the texture from the mipmaps stored in the tiles instead of the full texture, saved as _texture_preview<level>.bmp',
+						default=0, type=int, choices=[0, 1, 2, 3])
 	parser.description = 'Spring RTS SMF map compiler/decompiler by Beherith (mysterme@gmail.com). You must select at least a texture and a heightmap for compilation'
 	parser.epilog = 'Remember, you can also use this from the command line!'
 
@@ -912,7 +2041,8 @@ if __name__ == "__main__":
 		parsed_args = self.parse_args()
 		print (parsed_args)
 		if parsed_args.decompile != '' and parsed_args.decompile != None:
-			mymap = SMFMapDecompiler(parsed_args.decompile)
+			mymap = SMFMapDecompiler(parsed_args.decompile, parsed_args.only, parsed_args.region,
+									 parsed_args.preview_level, parsed_args.stream)
 		else:
 			compileSMF(parsed_args)
 	#print 'sys.argv:',sys.argv
@@ -932,7 +2062,8 @@ if __name__ == "__main__":
 			parsed_args = a.parse_args()
 			print (parsed_args)
 			if parsed_args.decompile != '' and parsed_args.decompile != None:
-				mymap = SMFMapDecompiler(parsed_args.decompile)
+				mymap = SMFMapDecompiler(parsed_args.decompile, parsed_args.only, parsed_args.region,
+										 parsed_args.preview_level, parsed_args.stream)
 			else:
 				compileSMF(parsed_args)
 		else:
@@ -4,7 +4,7 @@ from cx_Freeze import setup, Executable
 # Dependencies are automatically detected, but it might need fine tuning.
 
 build_exe_options = {
-						"packages": ["os"],
+						"packages": ["os", "numpy"],
 						"excludes": ["Tkinter", "Tk", "Tcl"],
 						"include_files": ["icon.ico", "nvdxt.exe", "LICENSE", "README.md", "geovent.bmp"]
 }